@@ -0,0 +1,775 @@
+import argparse
+import concurrent.futures
+import os
+import pickle
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from build import digest, stat_fingerprint
+from sketches import HyperLogLog
+
+state_map = {
+    "AC": "Acre",
+    "AL": "Alagoas",
+    "AM": "Amazonas",
+    "AP": "Amapá",
+    "BA": "Bahia",
+    "CE": "Ceará",
+    "DF": "Distrito Federal",
+    "ES": "Espírito Santo",
+    "GO": "Goiás",
+    "MA": "Maranhão",
+    "MG": "Minas Gerais",
+    "MS": "Mato Grosso do Sul",
+    "MT": "Mato Grosso",
+    "PA": "Pará",
+    "PB": "Paraíba",
+    "PE": "Pernambuco",
+    "PI": "Piauí",
+    "PR": "Paraná",
+    "RJ": "Rio de Janeiro",
+    "RN": "Rio Grande do Norte",
+    "RO": "Rondônia",
+    "RR": "Roraima",
+    "RS": "Rio Grande do Sul",
+    "SC": "Santa Catarina",
+    "SE": "Sergipe",
+    "SP": "São Paulo",
+    "TO": "Tocantins"
+}
+
+days_of_week_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Delivery durations in whole days. The shipping limit is set per item, so
+# diff_carrier_limit is counted over items and the rest over orders
+order_diff_columns = ["diff_delivered_carrier", "diff_delivered_estimated", "diff_delivered_ordered", "diff_carrier_ordered"]
+item_diff_columns = ["diff_carrier_limit"]
+
+# (end, start) timestamps of each duration. diff_delivered_estimated compares
+# the delivery day, not the delivery time, with the estimate
+diff_timestamps = {
+    "diff_delivered_carrier": ("order_delivered_customer_date", "order_delivered_carrier_date"),
+    "diff_delivered_estimated": ("order_delivered_customer_date", "order_estimated_delivery_date"),
+    "diff_carrier_limit": ("order_delivered_carrier_date", "shipping_limit_date"),
+    "diff_delivered_ordered": ("order_delivered_customer_date", "order_purchase_timestamp"),
+    "diff_carrier_ordered": ("order_delivered_carrier_date", "order_purchase_timestamp"),
+}
+normalized_diff_columns = ["diff_delivered_estimated"]
+
+day_ns = 86_400 * 10 ** 9
+
+# Per-state distinct counts for fig6 and the summary cards, and the ids that
+# are only counted overall
+state_distinct_columns = ["customer_unique_id", "customer_city", "customer_zip_code_prefix"]
+distinct_columns = ["seller_id", "product_id"]
+
+# Per-state quantiles of every delivery duration, shown next to the means
+quantiles = {"p50": 0.5, "p90": 0.9, "p99": 0.99}
+
+
+def diff_days(frame):
+    # Whole days between each pair of timestamps, floored like Timedelta.days,
+    # as nullable int16. Every timestamp column is read once as int64 epoch
+    # nanoseconds and the differences are taken on those
+    columns = {col for pair in diff_timestamps.values() for col in pair}
+    epoch_ns = {col: frame[col].to_numpy("datetime64[ns]").view("int64") for col in columns}
+    missing = {col: frame[col].isna().to_numpy() for col in columns}
+
+    days = {}
+    for col, (end, start) in diff_timestamps.items():
+        end_ns = epoch_ns[end] // day_ns * day_ns if col in normalized_diff_columns else epoch_ns[end]
+        mask = missing[end] | missing[start]
+        values = np.where(mask, 0, (end_ns - epoch_ns[start]) // day_ns).astype(np.int16)
+        days[col] = pd.arrays.IntegerArray(values, mask)
+    return days
+
+
+def enrich(frame):
+    frame["price_with_freight_charges"] = frame["price"] + frame["freight_value"]
+
+    for col, days in diff_days(frame).items():
+        frame[col] = days
+
+    frame['day_of_week'] = frame['order_purchase_timestamp'].dt.dayofweek
+    frame['hour_of_day'] = frame['order_purchase_timestamp'].dt.hour
+    # Months since 1970-01, the ordinal of the month period
+    frame['month_ordinal'] = (
+        frame['order_purchase_timestamp'].dt.year * 12 + frame['order_purchase_timestamp'].dt.month - 1970 * 12 - 1
+    ).astype("Int32")
+    frame['delivery_time_days'] = frame['diff_delivered_ordered']
+    frame['is_late'] = frame['order_delivered_customer_date'] > frame['order_estimated_delivery_date']
+    return frame
+
+
+# The same enrichment on an Arrow table, for the Arrow backend. Arrow's integer
+# division truncates towards zero, so durations are floored by hand
+def _floor_divide(values, divisor):
+    quotient = pc.divide(values, divisor)
+    remainder = pc.subtract(values, pc.multiply(quotient, divisor))
+    return pc.if_else(pc.less(remainder, 0), pc.subtract(quotient, 1), quotient)
+
+
+def enrich_table(table):
+    columns = {col for pair in diff_timestamps.values() for col in pair}
+    epoch_ns = {col: table[col].cast(pa.timestamp("ns")).cast(pa.int64()) for col in columns}
+    days = {}
+    for col, (end, start) in diff_timestamps.items():
+        end_ns = pc.multiply(_floor_divide(epoch_ns[end], day_ns), day_ns) if col in normalized_diff_columns else epoch_ns[end]
+        days[col] = _floor_divide(pc.subtract(end_ns, epoch_ns[start]), day_ns).cast(pa.int16())
+
+    purchased = table["order_purchase_timestamp"]
+    enriched = {
+        "price_with_freight_charges": pc.add(table["price"], table["freight_value"]),
+        **days,
+        "day_of_week": pc.day_of_week(purchased),
+        "hour_of_day": pc.hour(purchased),
+        "month_ordinal": pc.add(pc.multiply(pc.subtract(pc.year(purchased), 1970), 12),
+                                pc.subtract(pc.month(purchased), 1)).cast(pa.int32()),
+        "delivery_time_days": days["diff_delivered_ordered"],
+        "is_late": pc.fill_null(pc.greater(table["order_delivered_customer_date"],
+                                           table["order_estimated_delivery_date"]), False),
+    }
+    for name, values in enriched.items():
+        table = table.append_column(name, values)
+    return table
+
+
+def _grouped(table, keys, aggregations):
+    # Table.group_by on Arrow's thread pool, as a pandas frame indexed by the
+    # keys with the rows of null keys dropped, like a pandas groupby. Each
+    # aggregation is (column, function[, options]), with [] counting rows
+    result = table.group_by(keys).aggregate(list(aggregations.values()))
+    outputs = {name: "count_all" if not aggregation[0] else f"{aggregation[0]}_{aggregation[1]}"
+               for name, aggregation in aggregations.items()}
+    valid = pc.is_valid(result[keys[0]])
+    for key in keys[1:]:
+        valid = pc.and_(valid, pc.is_valid(result[key]))
+    frame = result.filter(valid).to_pandas()
+    return frame.rename(columns={output: name for name, output in outputs.items()}).set_index(keys)[list(outputs)]
+
+
+# Sums of groups without values are 0, as in pandas
+_sum_options = pc.ScalarAggregateOptions(min_count=0)
+
+
+def _sum(parts):
+    parts = [part for part in parts if part is not None]
+    combined = pd.concat(parts)
+    return combined.groupby(level=list(range(combined.index.nlevels)), observed=True, sort=False).sum()
+
+
+def _state_quantile(counts, q):
+    # The smallest day by which a q share of the state's rows is reached,
+    # read off the per-state day counts
+    counts = counts.sort_index()
+    by_state = counts.groupby(level="customer_state", observed=True)
+    reached = counts[by_state.cumsum() >= q * by_state.transform("sum")]
+    days = reached.index.to_frame(index=False).groupby("customer_state", observed=True)["days"].first()
+    return days.rename(index=str).astype("int64")
+
+
+class TimeCube:
+    # Dense state x month x weekday x hour array of the measures below, from
+    # which every temporal figure is sliced and summed. Missing states are kept
+    # under "" so the totals still count their orders
+
+    measures = ["num_orders", "num_items", "price_sum", "delivery_sum", "delivery_count"]
+
+    def __init__(self, states, months, values):
+        self.states = list(states)
+        self.months = months
+        self.values = values
+
+    @staticmethod
+    def cells(frame):
+        # Sparse cells of one batch, keyed by integer-coded dimensions and
+        # summed with one bincount per measure
+        frame = frame[frame["month_ordinal"].notna()]
+        is_order = (frame["order_item_id"] == 1).to_numpy()
+        delivery = frame["delivery_time_days"].to_numpy(dtype="float64", na_value=np.nan)
+        has_delivery = is_order & ~np.isnan(delivery)
+        measures = [
+            is_order,
+            np.ones(len(frame)),
+            np.nan_to_num(frame["price"].to_numpy(dtype="float64", na_value=np.nan)),
+            np.where(has_delivery, delivery, 0),
+            has_delivery,
+        ]
+
+        state_codes, states = pd.factorize(frame["customer_state"].astype(object).fillna(""))
+        months = frame["month_ordinal"].to_numpy(dtype="int64")
+        first_month = months.min() if len(months) else 0
+        month_count = months.max() - first_month + 1 if len(months) else 1
+        keys = ((state_codes * month_count + (months - first_month)) * 7
+                + frame["day_of_week"].to_numpy(dtype="int64")) * 24 + frame["hour_of_day"].to_numpy(dtype="int64")
+        keys, inverse = np.unique(keys, return_inverse=True)
+
+        index = pd.MultiIndex.from_arrays(
+            [np.asarray(states)[keys // (24 * 7 * month_count)], keys // (24 * 7) % month_count + first_month,
+             keys // 24 % 7, keys % 24],
+            names=["customer_state", "month_ordinal", "day_of_week", "hour_of_day"]
+        )
+        return pd.DataFrame(
+            {name: np.bincount(inverse, weights=measure, minlength=len(keys))
+             for name, measure in zip(TimeCube.measures, measures)},
+            index=index
+        )
+
+    @staticmethod
+    def table_cells(table):
+        # The same cells from an Arrow table, summed by one group_by
+        table = table.filter(pc.is_valid(table["month_ordinal"]))
+        is_order = pc.fill_null(pc.equal(table["order_item_id"], 1), False)
+        delivery = table["delivery_time_days"].cast(pa.float64())
+        has_delivery = pc.and_(is_order, pc.is_valid(delivery))
+        measures = pa.table({
+            "customer_state": pc.fill_null(table["customer_state"].cast(pa.string()), ""),
+            "month_ordinal": table["month_ordinal"],
+            "day_of_week": table["day_of_week"],
+            "hour_of_day": table["hour_of_day"],
+            "num_orders": is_order.cast(pa.float64()),
+            "num_items": pa.array(np.ones(len(table))),
+            "price_sum": pc.fill_null(table["price"], 0.0),
+            "delivery_sum": pc.if_else(has_delivery, delivery, 0.0),
+            "delivery_count": has_delivery.cast(pa.float64()),
+        })
+        return _grouped(measures, ["customer_state", "month_ordinal", "day_of_week", "hour_of_day"],
+                        {name: (name, "sum") for name in TimeCube.measures})
+
+    @classmethod
+    def from_cells(cls, cells):
+        states = sorted(cells.index.unique("customer_state"))
+        ordinals = cells.index.get_level_values("month_ordinal").to_numpy(dtype="int64")
+        first_month = ordinals.min() if len(ordinals) else 0
+        months = pd.PeriodIndex.from_ordinals(np.arange(first_month, ordinals.max() + 1 if len(ordinals) else 0), freq="M")
+
+        values = np.zeros((len(states), len(months), 7, 24, len(cls.measures)))
+        values[
+            pd.Index(states).get_indexer(cells.index.get_level_values("customer_state")),
+            ordinals - first_month,
+            cells.index.get_level_values("day_of_week").to_numpy(dtype="int64"),
+            cells.index.get_level_values("hour_of_day").to_numpy(dtype="int64"),
+        ] = cells[cls.measures].to_numpy()
+        return cls(states, months, values)
+
+    def measure(self, name):
+        return self.values[..., self.measures.index(name)]
+
+    def select(self, states=None, first_month=None, last_month=None):
+        # Sub-cube of some states and a range of month ordinals (both included)
+        state_mask = np.isin(self.states, states) if states is not None else np.ones(len(self.states), dtype=bool)
+        ordinals = self.months.asi8
+        month_mask = np.ones(len(ordinals), dtype=bool)
+        if first_month is not None:
+            month_mask &= ordinals >= first_month
+        if last_month is not None:
+            month_mask &= ordinals <= last_month
+        return TimeCube(np.asarray(self.states)[state_mask], self.months[month_mask],
+                        self.values[state_mask][:, month_mask])
+
+    def tables(self):
+        # The tables of the temporal figures (fig7, fig11, fig12 and fig13)
+        hourly_pivot = pd.DataFrame(
+            self.measure("num_orders").sum(axis=(0, 1)).astype("int64"),
+            index=pd.Index(days_of_week_order, name="day_of_week"),
+            columns=pd.Index(range(24), name="hour_of_day")
+        )
+
+        monthly = self.values.sum(axis=(0, 2, 3))
+        ordered = monthly[:, self.measures.index("num_orders")] > 0
+        monthly = pd.DataFrame(monthly[ordered], index=self.months[ordered], columns=self.measures)
+        month_labels = monthly.index.astype(str)
+        delivery_trend = pd.DataFrame({
+            'order_purchase_timestamp': month_labels,
+            'delivery_time_days': (monthly["delivery_sum"] / monthly["delivery_count"]).to_numpy()
+        })
+        orders_monthly = pd.DataFrame({
+            'order_purchase_timestamp': month_labels,
+            'num_orders': monthly["num_orders"].astype("int64").to_numpy()
+        })
+
+        state_month = self.values.sum(axis=(2, 3))
+        state_index, month_index = np.nonzero(state_month[..., self.measures.index("num_items")])
+        state_month_sales = pd.Series(
+            state_month[state_index, month_index, self.measures.index("price_sum")],
+            index=pd.MultiIndex.from_arrays(
+                [pd.Index(self.states)[state_index].map(state_map), self.months[month_index].astype(str)],
+                names=["customer_state_full", "month_year"]
+            )
+        )
+        state_month_sales = state_month_sales[state_month_sales.index.get_level_values(0).notna()]
+        return {
+            "hourly_pivot": hourly_pivot,
+            "delivery_trend": delivery_trend,
+            "orders_monthly": orders_monthly,
+            "state_month_sales": state_month_sales,
+        }
+
+
+def _first_seen(lists):
+    return list(dict.fromkeys(value for values in lists for value in values))
+
+
+class Partials:
+    # Mergeable aggregates of the enriched item-level frame. Every field is keyed
+    # by a small dimension (state, month, day, status...) except the per-customer
+    # table behind CLV and first purchases, and the distinct-value tables.
+    # px colors states and statuses in the order they come in, so tables() puts
+    # them in a fixed order (state_map's, and alphabetical) that doesn't depend
+    # on how the rows were split into batches or partitions.
+    #
+    # Delivery durations are whole days, so day_counts (rows per state, metric
+    # and day) is an exact mergeable sketch of their distributions: means and
+    # quantiles are both read off it without sorting any column.
+    #
+    # Distinct counts are exact by default. Folding with a sketch precision keeps
+    # a HyperLogLog sketch per state (and one overall for the ids only counted
+    # overall) instead of the distinct values themselves.
+    #
+    # A row with order_item_id == 1 stands for its order, so order-grain metrics
+    # count every order exactly once however the items are split into batches.
+    # The carrier date was imputed per item, so the order-grain carrier
+    # durations (fig1, fig5 and their choropleths) are those of item 1, not of
+    # whichever item of the order happens to come first.
+    # Only fig15 needs all the items of an order together: open_orders collects
+    # them until close_orders() is called at a point no order spans, such as the
+    # end of a purchase-month partition.
+
+    fields = ["day_counts", "state_items", "state_orders", "time_cells", "status_counts",
+              "items_per_order", "open_orders", "customers"]
+
+    def __init__(self):
+        for name in self.fields:
+            setattr(self, name, None)
+        self.state_values = {}
+        self.values = {}
+        self.state_sketches = {}
+        self.sketches = {}
+
+    @classmethod
+    def fold(cls, frame, precision=None):
+        part = cls()
+        orders = frame[frame["order_item_id"] == 1]
+
+        # Rows without a known state are counted under "", as in the time cube,
+        # so the histograms count every row while the per-state stats skip them
+        days = frame[order_diff_columns + item_diff_columns].assign(
+            customer_state=frame["customer_state"].astype(object).fillna("")
+        )
+        order_days = days[(frame["order_item_id"] == 1).to_numpy()]
+        part.day_counts = pd.concat(
+            {col: rows.groupby(["customer_state", col]).size().rename_axis(["customer_state", "days"])
+             for col, rows in [(col, order_days) for col in order_diff_columns] + [(col, days) for col in item_diff_columns]},
+            names=["metric"]
+        )
+        part.state_items = frame.groupby("customer_state", observed=True).agg(
+            price_sum=("price", "sum"),
+            price_count=("price", "count"),
+            freight_sum=("freight_value", "sum"),
+            freight_count=("freight_value", "count")
+        )
+        part.state_orders = orders.groupby("customer_state", observed=True).agg(
+            num_orders=("is_late", "size"),
+            late_orders=("is_late", "sum")
+        )
+        part.time_cells = TimeCube.cells(frame)
+        part.status_counts = orders.groupby("order_status", observed=True).size()
+        part.open_orders = frame.groupby("order_id", observed=True, sort=False).agg(
+            num_items=("price", "size"),
+            price_sum=("price", "sum")
+        )
+        # A customer belongs to the state of their first purchase with a known
+        # state, so the state doesn't depend on how the rows were split or
+        # ordered. state_date is that purchase's date, for combine() to compare
+        part.customers = frame.assign(
+            state_date=frame["order_purchase_timestamp"].where(frame["customer_state"].notna())
+        ).sort_values("order_purchase_timestamp", kind="stable").groupby(
+            "customer_unique_id", observed=True, sort=False
+        ).agg(
+            lifetime_value=("price_with_freight_charges", "sum"),
+            state=("customer_state", "first"),
+            first_purchase_date=("order_purchase_timestamp", "min"),
+            state_date=("state_date", "min")
+        )
+
+        if precision is None:
+            part.state_values = {col: frame[["customer_state", col]].drop_duplicates() for col in state_distinct_columns}
+            part.values = {col: frame[col].drop_duplicates() for col in distinct_columns}
+        else:
+            states = frame["customer_state"].astype(str)
+            part.state_sketches = {col: HyperLogLog.grouped(states, frame[col], precision)
+                                   for col in state_distinct_columns}
+            part.sketches = {col: HyperLogLog(precision).update(frame[col]) for col in distinct_columns}
+        return part
+
+    @classmethod
+    def fold_table(cls, table, precision=None):
+        # fold() on an Arrow table (enriched by enrich_table), grouping with
+        # pyarrow.compute so only the aggregates are converted to pandas
+        part = cls()
+        is_order = pc.fill_null(pc.equal(table["order_item_id"], 1), False)
+        orders = table.filter(is_order)
+
+        days = pa.table({
+            "customer_state": pc.fill_null(table["customer_state"].cast(pa.string()), ""),
+            **{col: table[col] for col in order_diff_columns + item_diff_columns},
+        })
+        order_days = days.filter(is_order)
+        part.day_counts = pd.concat(
+            {col: _grouped(rows, ["customer_state", col], {"count": ([], "count_all")})["count"]
+                  .rename_axis(["customer_state", "days"]).rename(None)
+             for col, rows in [(col, order_days) for col in order_diff_columns] + [(col, days) for col in item_diff_columns]},
+            names=["metric"]
+        )
+        part.state_items = _grouped(table, ["customer_state"], {
+            "price_sum": ("price", "sum", _sum_options),
+            "price_count": ("price", "count"),
+            "freight_sum": ("freight_value", "sum", _sum_options),
+            "freight_count": ("freight_value", "count")
+        })
+        part.state_orders = _grouped(orders, ["customer_state"], {
+            "num_orders": ([], "count_all"),
+            "late_orders": ("is_late", "sum", _sum_options)
+        })
+        part.time_cells = TimeCube.table_cells(table)
+        status_counts = _grouped(orders, ["order_status"], {"count": ([], "count_all")})["count"]
+        part.status_counts = status_counts.rename(index=str).rename(None)
+        part.open_orders = _grouped(table, ["order_id"], {
+            "num_items": ([], "count_all"),
+            "price_sum": ("price", "sum", _sum_options)
+        })
+        # "first" needs the rows in order, so this group_by runs on one thread
+        states = table["customer_state"].cast(pa.string())
+        purchased = table["order_purchase_timestamp"]
+        purchases = pa.table({
+            "customer_unique_id": table["customer_unique_id"],
+            "lifetime_value": table["price_with_freight_charges"],
+            "state": states,
+            "first_purchase_date": purchased,
+            "state_date": pc.if_else(pc.is_valid(states), purchased, pa.scalar(None, purchased.type)),
+        })
+        purchases = purchases.take(pc.sort_indices(purchases, [("first_purchase_date", "ascending")]))
+        customers = purchases.group_by("customer_unique_id", use_threads=False).aggregate([
+            ("lifetime_value", "sum", _sum_options), ("state", "first"), ("first_purchase_date", "min"),
+            ("state_date", "min")
+        ])
+        customers = customers.filter(pc.is_valid(customers["customer_unique_id"])).to_pandas()
+        part.customers = customers.set_index("customer_unique_id").rename(columns={
+            "lifetime_value_sum": "lifetime_value", "state_first": "state", "first_purchase_date_min": "first_purchase_date",
+            "state_date_min": "state_date"
+        })[["lifetime_value", "state", "first_purchase_date", "state_date"]]
+
+        if precision is None:
+            part.state_values = {col: table.group_by(["customer_state", col]).aggregate([]).to_pandas()
+                                 for col in state_distinct_columns}
+            part.values = {col: pc.unique(table[col]).to_pandas() for col in distinct_columns}
+        else:
+            states = pc.fill_null(table["customer_state"].cast(pa.string()), "nan").to_pandas()
+            part.state_sketches = {col: HyperLogLog.grouped(states, table[col].to_pandas(), precision)
+                                   for col in state_distinct_columns}
+            part.sketches = {col: HyperLogLog(precision).update(table[col].to_pandas()) for col in distinct_columns}
+        return part
+
+    @classmethod
+    def combine(cls, parts):
+        parts = list(parts)
+        total = cls()
+        for name in ["day_counts", "state_items", "state_orders", "time_cells", "status_counts",
+                     "items_per_order", "open_orders"]:
+            if any(getattr(part, name) is not None for part in parts):
+                setattr(total, name, _sum(getattr(part, name) for part in parts))
+
+        customers = pd.concat([part.customers for part in parts]).sort_values("state_date", kind="stable")
+        total.customers = customers.groupby(level=0, observed=True, sort=False).agg(
+            lifetime_value=("lifetime_value", "sum"),
+            state=("state", "first"),
+            first_purchase_date=("first_purchase_date", "min"),
+            state_date=("state_date", "min")
+        )
+
+        if parts[0].state_values:
+            total.state_values = {col: pd.concat([part.state_values[col] for part in parts]).drop_duplicates()
+                                  for col in state_distinct_columns}
+            total.values = {col: pd.concat([part.values[col] for part in parts]).drop_duplicates()
+                            for col in distinct_columns}
+        else:
+            for col in state_distinct_columns:
+                states = _first_seen(part.state_sketches[col] for part in parts)
+                total.state_sketches[col] = {
+                    state: HyperLogLog.union(part.state_sketches[col][state] for part in parts
+                                             if state in part.state_sketches[col])
+                    for state in states
+                }
+            total.sketches = {col: HyperLogLog.union(part.sketches[col] for part in parts)
+                              for col in distinct_columns}
+        return total
+
+    def close_orders(self):
+        if self.open_orders is None:
+            return self
+        closed = self.open_orders.groupby("num_items").agg(
+            price_sum=("price_sum", "sum"),
+            item_count=("num_items", "sum")
+        )
+        self.items_per_order = closed if self.items_per_order is None else _sum([self.items_per_order, closed])
+        self.open_orders = None
+        return self
+
+    def tables(self):
+        # The small frames the figures are drawn from
+        states = sorted(set(self.state_items.index.astype(str)) | set(self.state_orders.index.astype(str)))
+        state_index = pd.Index(states, name="customer_state")
+
+        state_stats = pd.DataFrame(index=state_index)
+        day_counts = self.day_counts.rename(index=str, level="customer_state")
+        # A slice of the rows without any value of a duration has no counts for it
+        metrics = set(day_counts.index.unique("metric"))
+        no_counts = day_counts.iloc[:0].droplevel("metric")
+        histograms = {}
+        mean_columns = {
+            "diff_delivered_carrier": "avg_delivered_after_ship",
+            "diff_delivered_estimated": "avg_diff_estimated",
+            "diff_carrier_limit": "avg_shiplimit_diff",
+            "diff_delivered_ordered": "avg_delivery_time",
+            "diff_carrier_ordered": "avg_shipping_delay",
+        }
+        for col, mean_col in mean_columns.items():
+            counts = day_counts.xs(col, level="metric") if col in metrics else no_counts
+            days = counts.index.get_level_values("days").to_numpy(dtype="float64")
+            state_stats[mean_col] = (
+                (counts * days).groupby(level="customer_state", observed=True).sum()
+                / counts.groupby(level="customer_state", observed=True).sum()
+            )
+            for name, q in quantiles.items():
+                state_stats[f"{col}_{name}"] = _state_quantile(counts, q)
+            histograms[col] = counts.groupby(level="days", observed=True).sum().rename(index=int).sort_index()
+
+        distinct = {}
+        for col, count_col in [("customer_unique_id", "customer_count"), ("customer_city", "city_count"),
+                               ("customer_zip_code_prefix", "zip_count")]:
+            if self.state_values:
+                pairs = self.state_values[col]
+                counts = pairs.groupby(pairs["customer_state"].astype(str))[col].nunique()
+                distinct[col] = pairs[col].nunique()
+            else:
+                sketches = self.state_sketches[col]
+                counts = pd.Series({state: sketch.count() for state, sketch in sketches.items()}, dtype="int64")
+                distinct[col] = HyperLogLog.union(sketches.values()).count()
+            state_stats[count_col] = counts.reindex(states, fill_value=0)
+        for col in distinct_columns:
+            distinct[col] = len(self.values[col]) if self.values else self.sketches[col].count()
+
+        state_items = self.state_items.rename(index=str).reindex(states)
+        state_stats["average_sales"] = state_items["price_sum"] / state_items["price_count"]
+        state_stats["freight_value"] = state_items["freight_sum"] / state_items["freight_count"]
+
+        state_orders = self.state_orders.rename(index=str).reindex(states, fill_value=0).astype("int64")
+        state_stats["orders_count"] = state_orders["num_orders"]
+
+        # CLV is a per-customer total, averaged over the customers of each state
+        state_stats["avg_clv"] = self.customers.groupby(self.customers["state"].astype(str)).lifetime_value.mean()
+
+        state_stats = state_stats.reset_index()
+        state_stats["customer_state_full"] = state_stats["customer_state"].map(state_map)
+
+        late_deliveries = state_orders.reset_index()
+        late_deliveries.insert(0, "customer_state_full", late_deliveries.pop("customer_state").map(state_map))
+        late_deliveries["late_orders_percentage"] = late_deliveries["late_orders"] / late_deliveries["num_orders"]
+
+        status_counts = self.status_counts.rename(index=str).sort_index().astype("int64")
+        status_counts = status_counts.rename_axis("order_status").reset_index(name="count")
+        status_counts["order_status"] = status_counts["order_status"].astype(str)
+
+        items_per_order = self.items_per_order.sort_index()
+        avg_price_data = pd.DataFrame({
+            'num_items': items_per_order.index.astype("int64"),
+            'price': (items_per_order["price_sum"] / items_per_order["item_count"]).to_numpy()
+        })
+
+        summary = {
+            "unique_sellers": distinct["seller_id"],
+            "unique_customers": distinct["customer_unique_id"],
+            "unique_cities": distinct["customer_city"],
+            "unique_states": len(states),
+            "unique_regions": distinct["customer_zip_code_prefix"],
+            "unique_orders": int(self.status_counts.sum()),
+            "unique_products": distinct["product_id"],
+        }
+
+        return {
+            "summary": summary,
+            "histograms": histograms,
+            "state_stats": state_stats,
+            "late_deliveries": late_deliveries,
+            # The temporal figures are all slices of the time cube
+            **TimeCube.from_cells(self.time_cells).tables(),
+            "state_order": [name for state, name in state_map.items() if state in states],
+            "customers": self.customers[["lifetime_value", "state", "first_purchase_date"]],
+            "avg_price_data": avg_price_data,
+            "status_counts": status_counts,
+        }
+
+
+def read_columns(path, columns, dictionary_columns):
+    columns = list(dict.fromkeys(columns))
+    return pq.read_table(
+        path,
+        columns=columns,
+        read_dictionary=[col for col in dictionary_columns if col in columns],
+        use_threads=True
+    )
+
+
+def load_columns(path, columns, dictionary_columns):
+    table = read_columns(path, columns, dictionary_columns)
+    return table.to_pandas(use_threads=True, split_blocks=True, self_destruct=True)
+
+
+def load_enriched_table(path, columns, dictionary_columns, cache_path, key):
+    # The enriched frame is kept as an uncompressed Arrow IPC file next to the
+    # key it was built for, and memory-mapped back while the key still matches
+    key_path = cache_path + ".key"
+    if os.path.exists(cache_path) and os.path.exists(key_path):
+        with open(key_path) as f:
+            if f.read() == key:
+                return pa.ipc.open_file(pa.memory_map(cache_path)).read_all()
+
+    frame = enrich(load_columns(path, columns, dictionary_columns))
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    with pa.OSFile(cache_path + ".tmp", "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(cache_path + ".tmp", cache_path)
+    with open(key_path, "w") as f:
+        f.write(key)
+    return table
+
+
+def load_enriched(path, columns, dictionary_columns, cache_path, key):
+    # The pandas metadata stored with the table restores the nullable dtypes
+    table = load_enriched_table(path, columns, dictionary_columns, cache_path, key)
+    return table.to_pandas(use_threads=True, split_blocks=True, self_destruct=True)
+
+
+def _fold_shared(name, start, stop, precision, backend):
+    # Runs in a worker: the table is read in place from the shared memory block
+    # and only its row range is folded
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        table = pa.ipc.open_stream(block.buf).read_all().slice(start, stop - start)
+        if backend == "arrow":
+            part = Partials.fold_table(table, precision)
+        else:
+            part = Partials.fold(table.to_pandas(), precision)
+        # Every buffer pointing into the block must be gone before closing it
+        del table
+    finally:
+        block.close()
+    return part
+
+
+def _write_stream(table, sink):
+    # The IPC writer holds on to the sink until it is freed with this frame
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def parallel_partials(table, workers, precision=None, backend="pandas"):
+    # Folds an enriched Arrow table on several processes. The table is written
+    # once as an Arrow IPC stream into a shared memory block, every worker maps
+    # the column buffers from there without copying them and folds a range of
+    # rows, and the partials are combined. Orders split across two ranges come
+    # together when the open orders are combined and closed.
+    sink = pa.MockOutputStream()
+    _write_stream(table, sink)
+    block = shared_memory.SharedMemory(create=True, size=max(sink.size(), 1))
+    try:
+        _write_stream(table, pa.FixedSizeBufferWriter(pa.py_buffer(block.buf)))
+        bounds = np.linspace(0, table.num_rows, workers + 1).astype(np.int64)
+        ranges = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            parts = list(pool.map(_fold_shared, [block.name] * len(ranges), *zip(*ranges),
+                                  [precision] * len(ranges), [backend] * len(ranges)))
+    finally:
+        block.close()
+        block.unlink()
+    return Partials.combine(parts).close_orders()
+
+
+def fold_batch(batch, precision=None, backend="pandas"):
+    if backend == "arrow":
+        return Partials.fold_table(enrich_table(pa.Table.from_batches([batch])), precision)
+    return Partials.fold(enrich(batch.to_pandas()), precision)
+
+
+def stream_partials(path, columns, dictionary_columns, batch_size=1 << 17, precision=None, backend="pandas",
+                    cache_dir=None, key=""):
+    # Folds a parquet dataset (a directory of files, e.g. one partition per
+    # purchase month) batch by batch, so only one batch of rows and the
+    # aggregates are held in memory. Orders are closed at the end of each file,
+    # so no order may span two files. With a cache_dir, each file's closed
+    # partials are pickled there under its size and mtime and the key of the
+    # fold settings, so a rerun only folds the files that changed
+    file_format = ds.ParquetFileFormat(read_options=ds.ParquetReadOptions(dictionary_columns=dictionary_columns))
+    dataset = ds.dataset(path, format=file_format, partitioning="hive")
+    total = None
+    cached = set()
+    for fragment in dataset.get_fragments():
+        part = None
+        if cache_dir is not None:
+            part_path = os.path.join(cache_dir, digest(key, stat_fingerprint(fragment.path)) + ".pkl")
+            cached.add(part_path)
+            if os.path.exists(part_path):
+                with open(part_path, "rb") as f:
+                    part = pickle.load(f)
+        if part is None:
+            batches = fragment.to_batches(columns=columns, batch_size=batch_size, use_threads=True)
+            part = Partials.combine(fold_batch(batch, precision, backend) for batch in batches if batch.num_rows)
+            part.close_orders()
+            if cache_dir is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                with open(part_path + ".tmp", "wb") as f:
+                    pickle.dump(part, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(part_path + ".tmp", part_path)
+        total = part if total is None else Partials.combine([total, part])
+    if cache_dir is not None and os.path.isdir(cache_dir):
+        # Files that were rewritten or removed leave their partials behind
+        for name in os.listdir(cache_dir):
+            if os.path.join(cache_dir, name) not in cached:
+                os.remove(os.path.join(cache_dir, name))
+    return total
+
+
+def write_month_partitions(source, destination):
+    # Rewrites the merged parquet as a hive-partitioned dataset with one
+    # directory per purchase month, streaming it batch by batch
+    dataset = ds.dataset(source, format="parquet")
+    schema = dataset.schema.append(pa.field("purchase_month", pa.string()))
+
+    def batches():
+        for batch in dataset.to_batches():
+            month = pc.strftime(batch.column("order_purchase_timestamp"), format="%Y-%m")
+            yield pa.RecordBatch.from_arrays(batch.columns + [month], schema=schema)
+
+    ds.write_dataset(
+        batches(),
+        destination,
+        schema=schema,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("purchase_month", pa.string())]), flavor="hive"),
+        existing_data_behavior="delete_matching"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the merged parquet as a dataset partitioned by purchase month")
+    parser.add_argument("source", help="merged parquet file, e.g. ../data/merged_info_after_impute.parquet")
+    parser.add_argument("destination", help="output directory for the partitioned dataset")
+    args = parser.parse_args()
+    write_month_partitions(args.source, args.destination)
+    print(f"Saved {args.destination}")
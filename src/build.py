@@ -0,0 +1,119 @@
+import ast
+import contextlib
+import gzip
+import hashlib
+import json
+import os
+import resource
+import sys
+import tracemalloc
+
+
+def digest(*parts):
+    sha = hashlib.sha256()
+    for part in parts:
+        sha.update(part if isinstance(part, bytes) else json.dumps(part, sort_keys=True, default=str).encode())
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def stat_fingerprint(path):
+    # Size and modification time of a file, or of every file under a directory,
+    # which is enough to notice a rewritten source without reading it
+    paths = [path] if os.path.isfile(path) else sorted(
+        os.path.join(root, name) for root, _, names in os.walk(path) for name in names
+    )
+    return [(os.path.relpath(p, path), os.stat(p).st_size, os.stat(p).st_mtime_ns) for p in paths]
+
+
+def function_digests(path):
+    # A digest per top-level function (or class) of a module, covering its own
+    # source, the module's other top-level statements and every module function
+    # it calls, so editing a helper only invalidates the functions that use it
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    tree = ast.parse(source)
+    lines = source.splitlines(keepends=True)
+    segments = {node: "".join(lines[node.lineno - 1:node.end_lineno]) for node in tree.body}
+    definitions = (ast.FunctionDef, ast.ClassDef)
+    functions = {node.name: node for node in tree.body if isinstance(node, definitions)}
+    preamble = [segment for node, segment in segments.items() if not isinstance(node, definitions)]
+    calls = {
+        name: {node.id for node in ast.walk(function) if isinstance(node, ast.Name) and node.id in functions}
+        for name, function in functions.items()
+    }
+
+    digests = {}
+    for name in functions:
+        used, pending = set(), [name]
+        while pending:
+            current = pending.pop()
+            if current not in used:
+                used.add(current)
+                pending += calls[current]
+        digests[name] = digest(preamble, [segments[functions[n]] for n in sorted(used)])
+    return digests
+
+
+def compress_siblings(path):
+    # Pre-compressed copies for static hosts that serve path.gz or path.br to
+    # clients accepting that encoding
+    import brotli
+
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path + ".gz", "wb") as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    with open(path + ".br", "wb") as f:
+        f.write(brotli.compress(data, quality=11))
+
+
+def load_manifest(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"tables": None, "table_digests": {}, "figures": {}}
+
+
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+class MemoryReport:
+    # Peak Python-traced allocations (numpy and pandas buffers included) of each
+    # build stage, above what was already held when the stage started, plus
+    # the resident set size of the build process
+
+    def __init__(self):
+        tracemalloc.start()
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        yield
+        self.add(name, tracemalloc.get_traced_memory()[1] - baseline)
+
+    def add(self, name, nbytes):
+        self.stages[name] = nbytes
+
+    def print(self):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_mb = peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+        print("Memory report (MB above what each stage started with):")
+        for name, nbytes in self.stages.items():
+            print(f"  {name:<16} {nbytes / 2 ** 20:10.1f}")
+        pages = {name: nbytes for name, nbytes in self.stages.items() if name != "tables"}
+        if pages:
+            largest = max(pages, key=pages.get)
+            print(f"  largest page: {largest} ({pages[largest] / 2 ** 20:.1f})")
+        print(f"  peak RSS of the build process: {peak_mb:.1f}")
@@ -0,0 +1,76 @@
+from build import digest, stat_fingerprint, function_digests
+
+# What the dashboard is built from, shared by the static build (app.py) and the
+# local server (server.py)
+parquet_path = r"../data/merged_info_after_impute.parquet"
+build_dir = r"../data/.build"
+geojson_url = "https://raw.githubusercontent.com/codeforamerica/click_that_hood/master/public/data/brazil-states.geojson"
+geojson_path = r"../data/brazil-states.geojson"
+
+# Parquet columns each figure reads; only their union is loaded
+figure_columns = {
+    "summary": ["seller_id", "customer_unique_id", "customer_city", "customer_state",
+                "customer_zip_code_prefix", "order_id", "product_id"],
+    "fig1": ["order_item_id", "order_id", "order_delivered_customer_date", "order_delivered_carrier_date"],
+    "fig2": ["order_item_id", "order_id", "order_delivered_customer_date", "order_estimated_delivery_date"],
+    "fig3": ["order_delivered_carrier_date", "shipping_limit_date"],
+    "fig4": ["order_item_id", "order_id", "order_delivered_customer_date", "order_purchase_timestamp"],
+    "fig5": ["order_item_id", "order_id", "order_delivered_carrier_date", "order_purchase_timestamp"],
+    "fig1_choropleth": ["order_item_id", "customer_state", "order_id", "order_delivered_customer_date", "order_delivered_carrier_date"],
+    "fig2_choropleth": ["order_item_id", "customer_state", "order_id", "order_delivered_customer_date", "order_estimated_delivery_date"],
+    "fig3_choropleth": ["customer_state", "order_delivered_carrier_date", "shipping_limit_date"],
+    "fig4_choropleth": ["order_item_id", "customer_state", "order_id", "order_delivered_customer_date", "order_purchase_timestamp"],
+    "fig5_choropleth": ["order_item_id", "customer_state", "order_id", "order_delivered_carrier_date", "order_purchase_timestamp"],
+    "fig6": ["customer_state", "customer_unique_id", "customer_city", "customer_zip_code_prefix"],
+    "fig7": ["order_item_id", "order_id", "order_purchase_timestamp"],
+    "fig8": ["order_item_id", "customer_state", "order_id", "order_delivered_customer_date", "order_estimated_delivery_date"],
+    "fig9": ["customer_state", "price"],
+    "fig10": ["customer_state", "freight_value"],
+    "fig11": ["order_item_id", "order_id", "order_purchase_timestamp", "order_delivered_customer_date"],
+    "fig12": ["order_item_id", "order_id", "order_purchase_timestamp"],
+    "fig13": ["customer_state", "order_purchase_timestamp", "price"],
+    "fig14": ["customer_state", "customer_unique_id", "order_id", "order_purchase_timestamp"],
+    "fig15": ["order_id", "price"],
+    "fig16": ["order_item_id", "order_id", "order_status"],
+    "fig17": ["customer_state", "customer_unique_id", "price", "freight_value"],
+    "fig18": ["order_item_id", "customer_state", "order_id"],
+}
+
+# Low-cardinality strings and the 32-char hex ids are decoded as dictionaries, so
+# pandas gets them as categoricals and groups on integer codes (snapshots written
+# before the ids were stored dictionary-encoded are encoded while decoding)
+id_columns = ["order_id", "customer_id", "customer_unique_id", "product_id", "seller_id"]
+dictionary_columns = ["customer_state", "customer_city", "order_status"] + id_columns
+
+# Aggregate tables each figure is drawn from; "geojson" marks the maps
+figure_inputs = {
+    "fig1": ["histograms"],
+    "fig2": ["histograms"],
+    "fig3": ["histograms"],
+    "fig4": ["histograms"],
+    "fig5": ["histograms"],
+    "fig1_choropleth": ["state_stats", "geojson"],
+    "fig2_choropleth": ["state_stats", "geojson"],
+    "fig3_choropleth": ["state_stats", "geojson"],
+    "fig4_choropleth": ["state_stats", "geojson"],
+    "fig5_choropleth": ["state_stats", "geojson"],
+    "fig6": ["state_stats", "geojson"],
+    "fig7": ["hourly_pivot"],
+    "fig8": ["late_deliveries"],
+    "fig9": ["state_stats", "geojson"],
+    "fig10": ["state_stats", "geojson"],
+    "fig11": ["delivery_trend"],
+    "fig12": ["orders_monthly"],
+    "fig13": ["state_month_sales", "state_order"],
+    "fig14": ["customers", "state_order"],
+    "fig15": ["avg_price_data"],
+    "fig16": ["status_counts"],
+    "fig17": ["state_stats", "geojson"],
+    "fig18": ["state_stats", "geojson"],
+}
+
+
+def enriched_key(source, columns):
+    # The memory-mapped enriched frame is keyed like the tables, but only by the
+    # code of enrich(), so app.py and server.py share it
+    return digest(stat_fingerprint(source), columns, dictionary_columns, function_digests("aggregates.py")["enrich"])
@@ -0,0 +1,1054 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+import base64
+import gc
+import tracemalloc
+import warnings
+from aggregates import state_map, quantiles
+from build import compress_siblings
+warnings.filterwarnings("ignore", category=pd.errors.SettingWithCopyWarning)
+
+# Every figure is a function of the aggregate tables (and the GeoJSON for the
+# maps) returning its plotly figure; app.py decides which ones need rebuilding.
+# The histograms keep plotly's default template, everything else is plotly_white
+pio.templates.default = "plotly_white"
+
+# Time-Based
+def clean_fig(fig, title, xaxis, yaxis):
+    fig.update_layout(
+        title=title,
+        xaxis_title=xaxis,
+        yaxis_title=yaxis,
+        title_x=0.5,
+        autosize=True,
+        margin=dict(l=50, r=50, t=80, b=50))
+    fig.update_traces(hovertemplate="Days: %{x}<br>Frequency: %{y}<extra></extra>")
+    return fig
+
+# Plots the day counts of a diff_* column over the same range as the old queries,
+# so the HTML only carries one bar per day instead of every row
+def binned_histogram(counts, raw, lower=None, upper=None):
+    if lower is not None:
+        counts = counts[counts.index >= lower]
+    if upper is not None:
+        counts = counts[counts.index <= upper]
+
+    if raw:
+        return px.histogram(x=np.repeat(counts.index.to_numpy(), counts.to_numpy()), template="plotly")
+
+    first = int(counts.index.min()) if len(counts) else 0
+    days = np.arange(first, int(counts.index.max()) + 1 if len(counts) else first)
+    # As a frame, since px reads two empty arrays as lists of column names
+    bars = pd.DataFrame({"x": days, "y": counts.reindex(days, fill_value=0).to_numpy()})
+    fig = px.bar(bars, x="x", y="y", template="plotly")
+    fig.update_layout(bargap=0)
+    return fig
+
+def fig1(tables, geojson, args):
+    fig1 = binned_histogram(tables["histograms"]["diff_delivered_carrier"], args.raw_histograms, upper=91.0)
+    return clean_fig(fig1, "How Long Until Your Order Arrives After Shipping?", "Days", "Frequency")
+
+def fig2(tables, geojson, args):
+    fig2 = binned_histogram(tables["histograms"]["diff_delivered_estimated"], args.raw_histograms, -60.0, 60.0)
+    return clean_fig(fig2, "How Early are Orders Delivered?", "Days (- / +)", "Frequency")
+
+def fig3(tables, geojson, args):
+    fig3 = binned_histogram(tables["histograms"]["diff_carrier_limit"], args.raw_histograms, -20.0, 60.0)
+    return clean_fig(fig3, "How Early Are Orders Shipped?", "Days (- / +)", "Frequency")
+
+def fig4(tables, geojson, args):
+    fig4 = binned_histogram(tables["histograms"]["diff_delivered_ordered"], args.raw_histograms, upper=75.0)
+    return clean_fig(fig4, "How Long Does Delivery Take?", "Days", "Frequency")
+
+def fig5(tables, geojson, args):
+    fig5 = binned_histogram(tables["histograms"]["diff_carrier_ordered"], args.raw_histograms, upper=50.0)
+    return clean_fig(fig5, "How Long Does It Take to Ship?", "Days", "Frequency")
+
+# --- State-level aggregates ---
+# Every state choropleth reads its metric from the one 27-row state_stats table
+def quantile_columns(col):
+    return [f"{col}_{name}" for name in quantiles]
+
+def add_quantile_menu(fig, state_stats, col, mean_col, noun):
+    # Dropdown that recolors the map by the per-state mean, median, p90 or p99
+    options = [("Mean", mean_col, "Avg")] + [
+        (prefix, column, prefix) for prefix, column in zip(["Median", "p90", "p99"], quantile_columns(col))
+    ]
+    fig.update_layout(updatemenus=[dict(
+        buttons=[
+            dict(label=label, method="update",
+                 args=[{"z": [state_stats[column]]}, {"coloraxis.colorbar.title.text": f"{prefix} {noun} (Days)"}])
+            for label, column, prefix in options
+        ],
+        direction="down", x=0.02, xanchor="left", y=0.98, yanchor="top"
+    )])
+
+def fig1_choropleth(tables, geojson, args):
+    # Average delivery time after shipping by state
+    state_stats = tables["state_stats"]
+
+    # Choropleth
+    fig1_choropleth = px.choropleth(
+        state_stats,
+        geojson=geojson,
+        locations="customer_state",
+        featureidkey="properties.sigla",
+        color="avg_delivered_after_ship",
+        color_continuous_scale="RdBu_r",
+        scope="world",
+        title="State-Wise: How Long Until Your Order Arrives After Shipping?",
+        hover_name="customer_state_full",
+        hover_data={},  
+    )
+
+    # Hover formatting
+    fig1_choropleth.update_traces(
+        customdata=state_stats[['avg_delivered_after_ship'] + quantile_columns("diff_delivered_carrier")],
+        hovertemplate=(
+            "<b>%{hovertext}</b><br>" +
+            "Avg Delivery After Shipping: %{customdata[0]:.2f} days<br>" +
+            "Median / p90 / p99: %{customdata[1]} / %{customdata[2]} / %{customdata[3]} days<br>" +
+            "<extra></extra>"
+        )
+    )
+
+    # Map bounds
+    fig1_choropleth.update_geos(
+        visible=False,
+        lataxis_range=[-38, 10],
+        lonaxis_range=[-78, -30]
+    )
+    fig1_choropleth.update_layout(margin={"r":0,"t":50,"l":0,"b":0})
+    fig1_choropleth.update_geos(fitbounds="locations", visible=False)
+    # Layout + legend title
+    fig1_choropleth.update_layout(margin={"r":0,"t":50,"l":0,"b":0},
+        coloraxis_colorbar=dict(
+            title=dict(
+                text="Avg Delay (Days)", 
+                side="right",              
+                font=dict(size=12)
+            ), x = 0.85
+        ), title_x=0.5
+        )
+    add_quantile_menu(fig1_choropleth, state_stats, "diff_delivered_carrier", "avg_delivered_after_ship", "Delay")
+    return fig1_choropleth
+
+def fig2_choropleth(tables, geojson, args):
+    # Average delivery timing vs estimated delivery date by state
+    state_stats = tables["state_stats"]
+
+    # Choropleth
+    fig2_choropleth = px.choropleth(
+        state_stats,
+        geojson=geojson,
+        locations="customer_state",
+        featureidkey="properties.sigla",
+        color="avg_diff_estimated",
+        color_continuous_scale="RdBu_r",
+        scope="world",
+        title="State-Wise: How Early are Orders Delivered?",
+        hover_name="customer_state_full",
+        hover_data={},  
+    )
+
+    # Hover formatting
+    fig2_choropleth.update_traces(
+        customdata=state_stats[['avg_diff_estimated'] + quantile_columns("diff_delivered_estimated")],
+        hovertemplate=(
+            "<b>%{hovertext}</b><br>" +
+            "Avg Difference: %{customdata[0]:.2f} days<br>" +
+            "Median / p90 / p99: %{customdata[1]} / %{customdata[2]} / %{customdata[3]} days<br>" +
+            "<extra></extra>"
+        )
+    )
+
+    # Map bounds
+    fig2_choropleth.update_geos(
+        visible=False,
+        lataxis_range=[-38, 10],
+        lonaxis_range=[-78, -30]
+    )
+
+    # Layout + legend rename
+    fig2_choropleth.update_layout(margin={"r":0,"t":50,"l":0,"b":0},
+        coloraxis_colorbar=dict(
+            title=dict(
+                text="Avg Diff (Days)", 
+                side="right",              
+                font=dict(size=12)
+            ), x = 0.85
+        ), title_x=0.5
+        )
+    fig2_choropleth.update_layout(margin={"r":0,"t":50,"l":0,"b":0})
+    fig2_choropleth.update_geos(fitbounds="locations", visible=False)
+    add_quantile_menu(fig2_choropleth, state_stats, "diff_delivered_estimated", "avg_diff_estimated", "Diff")
+    return fig2_choropleth
+
+def fig3_choropleth(tables, geojson, args):
+    # Average shipping timing vs shipping-limit by state
+    state_stats = tables["state_stats"]
+
+    # Choropleth
+    fig3_choropleth = px.choropleth(
+        state_stats,
+        geojson=geojson,
+        locations="customer_state",
+        featureidkey="properties.sigla",
+        color="avg_shiplimit_diff",
+        color_continuous_scale="RdBu_r",
+        scope="world",
+        title="State-Wise: How Early Are Orders Shipped?",
+        hover_name="customer_state_full",
+        hover_data={},  
+    )
+
+    # Hover formatting
+    fig3_choropleth.update_traces(
+        customdata=state_stats[['avg_shiplimit_diff'] + quantile_columns("diff_carrier_limit")],
+        hovertemplate=(
+            "<b>%{hovertext}</b><br>" +
+            "Avg Difference: %{customdata[0]:.2f} days<br>" +
+            "Median / p90 / p99: %{customdata[1]} / %{customdata[2]} / %{customdata[3]} days<br>" +
+            "<extra></extra>"
+        )
+    )
+
+    # Map bounds
+    fig3_choropleth.update_geos(
+        visible=False,
+        lataxis_range=[-38, 10],
+        lonaxis_range=[-78, -30]
+    )
+
+    # Layout + legend rename
+    fig3_choropleth.update_layout(
+        title_x=0.5,
+        coloraxis_colorbar=dict(title="Avg Diff (Days)")
+    )
+    fig3_choropleth.update_layout(margin={"r":0,"t":50,"l":0,"b":0},
+        coloraxis_colorbar=dict(
+            title=dict(
+                text="Avg Diff (Days)", 
+                side="right",              
+                font=dict(size=12)
+            ), x = 0.85
+        ), title_x=0.5
+        )
+    fig3_choropleth.update_geos(fitbounds="locations", visible=False)
+    add_quantile_menu(fig3_choropleth, state_stats, "diff_carrier_limit", "avg_shiplimit_diff", "Diff")
+    return fig3_choropleth
+
+def fig4_choropleth(tables, geojson, args):
+    # Average delivery time (order → delivered) by state
+    state_stats = tables["state_stats"]
+
+    # Choropleth
+    fig4_choropleth = px.choropleth(
+        state_stats,
+        geojson=geojson,
+        locations="customer_state",
+        featureidkey="properties.sigla",
+        color="avg_delivery_time",
+        color_continuous_scale="RdBu_r",
+        scope="world",
+        title="State-Wise: How Long Does Delivery Take?",
+        hover_name="customer_state_full",
+        hover_data={},  
+    )
+
+    # Hover formatting
+    fig4_choropleth.update_traces(
+        customdata=state_stats[['avg_delivery_time'] + quantile_columns("diff_delivered_ordered")],
+        hovertemplate=(
+            "<b>%{hovertext}</b><br>" +
+            "Average Delivery Time: %{customdata[0]:.2f} days<br>" +
+            "Median / p90 / p99: %{customdata[1]} / %{customdata[2]} / %{customdata[3]} days<br>" +
+            "<extra></extra>"
+        )
+    )
+
+    # Map bounds
+    fig4_choropleth.update_geos(
+        visible=False,
+        lataxis_range=[-38, 10],
+        lonaxis_range=[-78, -30]
+    )
+
+    # Layout + legend rename
+    fig4_choropleth.update_layout(
+        title_x=0.5,
+        coloraxis_colorbar=dict(title="Avg Time (Days)")
+    )
+    fig4_choropleth.update_layout(margin={"r":0,"t":50,"l":0,"b":0},
+        coloraxis_colorbar=dict(
+            title=dict(
+                text="Avg Time (Days)", 
+                side="right",              
+                font=dict(size=12)
+            ), x = 0.85
+        ), title_x=0.5
+        )
+    fig4_choropleth.update_geos(fitbounds="locations", visible=False)
+    add_quantile_menu(fig4_choropleth, state_stats, "diff_delivered_ordered", "avg_delivery_time", "Time")
+    return fig4_choropleth
+
+def fig5_choropleth(tables, geojson, args):
+    # Average shipping delay (order → carrier pickup) by state
+    state_stats = tables["state_stats"]
+
+    # Choropleth
+    fig5_choropleth = px.choropleth(
+        state_stats,
+        geojson=geojson,
+        locations="customer_state",
+        featureidkey="properties.sigla",
+        color="avg_shipping_delay",
+        color_continuous_scale="RdBu_r",
+        scope="world",
+        title="State-Wise: How Long Does It Take to Ship?",
+        hover_name="customer_state_full",
+        hover_data={},  
+    )
+
+    # Hover formatting
+    fig5_choropleth.update_traces(
+        customdata=state_stats[['avg_shipping_delay'] + quantile_columns("diff_carrier_ordered")],
+        hovertemplate=(
+            "<b>%{hovertext}</b><br>" +
+            "Average Shipping Delay: %{customdata[0]:.2f} days<br>" +
+            "Median / p90 / p99: %{customdata[1]} / %{customdata[2]} / %{customdata[3]} days<br>" +
+            "<extra></extra>"
+        )
+    )
+
+    # Map bounds
+    fig5_choropleth.update_geos(
+        visible=False,
+        lataxis_range=[-38, 10],
+        lonaxis_range=[-78, -30]
+    )
+
+    # Layout + legend rename
+    fig5_choropleth.update_layout(margin={"r":0,"t":50,"l":0,"b":0},
+        coloraxis_colorbar=dict(
+            title=dict(
+                text="Avg Delay (Days)", 
+                side="right",              
+                font=dict(size=12)
+            ), x = 0.85
+        ), title_x=0.5)
+    fig5_choropleth.update_geos(fitbounds="locations", visible=False)
+    add_quantile_menu(fig5_choropleth, state_stats, "diff_carrier_ordered", "avg_shipping_delay", "Delay")
+    return fig5_choropleth
+
+# Customers
+def fig6(tables, geojson, args):
+    # Number of customers per state
+    state_stats = tables["state_stats"]
+
+    fig6 = px.choropleth(
+        state_stats,
+        geojson=geojson,
+        locations="customer_state",
+        featureidkey="properties.sigla",
+        color="customer_count",
+        color_continuous_scale="Turbo",
+        scope="world",
+        title="Customer Demographics by State, City & Region",
+        hover_name="customer_state_full",
+        hover_data={},  
+    )
+
+    fig6.update_traces(
+        customdata = state_stats[['customer_count', 'city_count', 'zip_count']],
+        hovertemplate=(
+            "<b>%{hovertext}</b><br>" +
+            "Number of Customers: %{customdata[0]:,}<br>" +
+            "Cities: %{customdata[1]:,}<br>" +
+            "Unique Regions: %{customdata[2]:,}<br>" +
+            "<extra></extra>"
+        )
+    )
+
+    fig6.update_geos(
+        visible=False,
+        lataxis_range=[-38, 10],
+        lonaxis_range=[-78, -30]
+    )
+
+    fig6.update_layout(title_x=0.5, coloraxis_colorbar=dict(title="Customer Count"))
+
+    fig6.update_layout(margin={"r":0,"t":50,"l":0,"b":0},
+        coloraxis_colorbar=dict(
+            title=dict(
+                text="Customer Count", 
+                side="right",              
+                font=dict(size=12)
+            ), x = 0.85
+        ), title_x=0.5
+        )
+    fig6.update_geos(fitbounds="locations", visible=False)
+    return fig6
+
+def fig7(tables, geojson, args):
+    hourly_pivot = tables["hourly_pivot"]
+    fig7 = px.imshow(
+        hourly_pivot,
+        title="Order Activity: When Do Customers Shop?",
+        labels=dict(x="Hour of Day", y="Day of Week", color="Total Orders"),
+        color_continuous_scale="Plasma"
+    )
+    fig7.update_xaxes(nticks=24)
+
+    fig7.update_layout(
+        coloraxis_colorbar=dict(
+            title=dict(
+                text="Total Orders", 
+                side="right",              
+                font=dict(size=12)
+            )
+        ), title_x=0.5
+        )
+    return fig7
+
+# State-Wise
+def fig8(tables, geojson, args):
+    late_deliveries = tables["late_deliveries"]
+
+    # Sort by percentage
+    late_deliveries = late_deliveries.sort_values('late_orders_percentage', ascending=False)
+
+    # Plot
+    fig8 = px.bar(
+        late_deliveries,
+        x='customer_state_full',
+        y='late_orders_percentage',
+        color='late_orders_percentage',
+        color_continuous_scale="Turbo",
+        title='Percentage of Late Deliveries per State',
+        labels={
+            'customer_state_full': 'State',
+            'late_orders_percentage': 'Percentage of Late Orders'
+        }
+    )
+
+    # Center title and adjust layout
+    fig8.update_layout(
+        title={'x': 0.5},
+        xaxis=dict(categoryorder='total descending', tickangle = -45,  tickfont=dict(size=10)),
+        yaxis=dict(showgrid=True, gridcolor='lightgray'),
+        plot_bgcolor='white',
+        margin=dict(t=45),
+        coloraxis_colorbar=dict(
+            title=dict(
+                text="Percentage of Late Orders", 
+                side="right",              
+                font=dict(size=12)
+            ),
+        )
+    )
+
+    # Annotate bars with values rounded to 2 decimals
+    fig8.update_traces(
+        text=late_deliveries['late_orders_percentage'].round(2),
+        textposition='outside'
+    )
+    return fig8
+
+def fig9(tables, geojson, args):
+    # Avg sales price by state
+    state_stats = tables["state_stats"]
+
+    fig9 = px.choropleth(
+        state_stats,
+        geojson=geojson,
+        locations="customer_state",
+        featureidkey="properties.sigla",
+        color="average_sales",
+        color_continuous_scale="RdBu_r",
+        scope="world",
+        title="Average Sales Price by State",
+        hover_name="customer_state_full",
+        hover_data={},  
+    )
+
+    fig9.update_traces(
+        customdata=state_stats[['average_sales']],
+        hovertemplate=
+            "<b>%{hovertext}</b><br>" +
+            "Average Sales: $%{customdata[0]:,.2f}<br>" +
+            "<extra></extra>"
+    )
+
+    fig9.update_geos(
+        visible=False,
+        lataxis_range=[-38, 10],
+        lonaxis_range=[-78, -30]
+    )
+
+    fig9.update_geos(fitbounds="locations", visible=False)
+    fig9.update_layout(margin={"r":0,"t":50,"l":0,"b":0},
+        coloraxis_colorbar=dict(
+            title=dict(
+                text="Avg Sales ($)", 
+                side="right",              
+                font=dict(size=12)
+            ), x = 0.85
+        ), title_x=0.5
+        )
+    return fig9
+
+def fig10(tables, geojson, args):
+    # Avg freight price by state
+    state_stats = tables["state_stats"]
+
+    fig10 = px.choropleth(
+        state_stats,
+        geojson=geojson,
+        locations="customer_state",
+        featureidkey="properties.sigla",
+        color="freight_value",
+        color_continuous_scale="RdBu_r",
+        scope="world",
+        title="Average Freight Cost by State",
+        hover_name="customer_state_full",
+        hover_data={},       # remove automatic extras
+    )
+
+    # Match the custom hovertemplate style
+    fig10.update_traces(
+        customdata=state_stats[['freight_value']],
+        hovertemplate=
+            "<b>%{hovertext}</b><br>" +
+            "Average Freight: $%{customdata[0]:,.2f}<br>" +
+            "<extra></extra>"
+    )
+
+    # Same geo formatting
+    fig10.update_geos(
+        visible=False,
+        lataxis_range=[-38, 10],
+        lonaxis_range=[-78, -30]
+    )
+
+    # Match title + legend formatting
+    fig10.update_layout(title_x=0.5,
+        coloraxis_colorbar=dict(
+        title=dict(
+            text="Avg Freight ($)", 
+            side="right",              
+            font=dict(size=12)),
+        x = 0.85
+        )
+    )
+    fig10.update_layout(margin={"r":0,"t":50,"l":0,"b":0})
+    fig10.update_geos(fitbounds="locations", visible=False)
+    return fig10
+
+# Trends
+def fig11(tables, geojson, args):
+    # Avg Delivery Time per Month
+    delivery_trend = tables["delivery_trend"]
+
+    fig11 = px.line(
+        delivery_trend,
+        x='order_purchase_timestamp',
+        y='delivery_time_days',
+        title='Average Delivery Time (days) By Month',
+        markers = True,
+        labels={'order_purchase_timestamp': 'Month', 'delivery_time_days': 'Avg Delivery Time (days)'}
+    )
+
+    fig11.update_traces(marker=dict(color="#ed1b76"))
+    fig11.update_layout(title_x = 0.5)
+    return fig11
+
+def fig12(tables, geojson, args):
+    # Monthly Orders
+    orders_monthly = tables["orders_monthly"]
+
+    fig12 = px.bar(
+        orders_monthly,
+        x='order_purchase_timestamp',
+        y='num_orders',
+        title='Monthly Orders Trend',
+        labels={'order_purchase_timestamp': 'Month', 'num_orders': 'Orders'},
+        color='num_orders',
+        color_continuous_scale='Plasma',
+        text='num_orders'                     # show numbers
+    )
+
+    fig12.update_traces(
+        texttemplate='%{text}',
+        textposition='outside'                # place above bars
+    )
+
+    fig12.update_layout(
+        title_x=0.5,
+        uniformtext_minsize=8,
+        uniformtext_mode='hide',              # avoid overlap
+        margin=dict(t=50),
+        coloraxis_colorbar=dict(
+            title=dict(
+                text="Orders", 
+                side="right",              
+                font=dict(size=12)
+            )
+        )
+        )
+    return fig12
+
+# Dynamic Plots
+def fig13(tables, geojson, args):
+    # Monthly Sales by State (Using customer_state_full)
+
+    state_month_sales = tables["state_month_sales"]
+    state_month_labels = state_month_sales.index.get_level_values('month_year').astype(str)
+
+    # Use the full state names, in state code order
+    all_states = np.asarray(tables["state_order"])
+    all_months = np.sort(state_month_labels.unique())
+
+    # Dense state x month grid of sales indexed by the categorical codes, padded to
+    # every state and month and laid out state by state
+    state_codes = pd.Categorical(state_month_sales.index.get_level_values('customer_state_full'), categories=all_states).codes
+    month_codes = pd.Categorical(state_month_labels, categories=all_months).codes
+    sales_grid = np.bincount(
+        state_codes.astype(np.int64) * len(all_months) + month_codes,
+        weights=state_month_sales.to_numpy(),
+        minlength=len(all_states) * len(all_months)
+    )
+
+    padded_data = pd.DataFrame({
+        'customer_state_full': np.repeat(all_states, len(all_months)),
+        'month_year': np.tile(all_months, len(all_states)),
+        'monthly_sales': sales_grid
+    })
+    padded_data = padded_data[padded_data['monthly_sales'] > 0]
+
+    fig13 = px.bar(
+        padded_data,
+        x="customer_state_full",
+        y="monthly_sales",
+        color="customer_state_full",
+        animation_frame="month_year",
+        animation_group="customer_state_full",
+        title="Monthly Sales by State (Log Scale)",
+        log_y=True,
+        labels={
+            "customer_state_full": "Customer State",
+            "monthly_sales": "Monthly Sales"
+        }
+    )
+
+    fig13.update_layout(
+        yaxis_range=[np.log10(1), np.log10(padded_data['monthly_sales'].max()) * 1.05],
+        title_x=0.5,
+        xaxis=dict(tickangle=-45, tickfont=dict(size=10)),
+        showlegend = False,
+        xaxis_title = None,
+    )
+
+    fig13.update_layout(
+        sliders=[{
+            'currentvalue': {
+                'prefix': '',
+                'font': {'size': 12}
+            }
+        }]
+    )
+    return fig13
+
+def fig14(tables, geojson, args):
+    # Cumulative Customer Growth
+    first_purchase = tables["customers"][['first_purchase_date']].copy()
+    first_purchase['customer_state_full'] = tables["customers"]['state'].map(state_map)
+
+    first_purchase['acquisition_month'] = first_purchase['first_purchase_date'].dt.to_period('M').astype(str)
+    all_months = sorted(first_purchase['acquisition_month'].unique())
+    all_states = np.asarray(tables["state_order"])
+
+    # State x month matrix of newly acquired customers, built once from categorical
+    # codes and summed along the months. Customers without a known state have
+    # code -1 and are left out
+    state_codes = pd.Categorical(first_purchase['customer_state_full'], categories=all_states).codes
+    month_codes = pd.Categorical(first_purchase['acquisition_month'], categories=all_months).codes
+    known = (state_codes >= 0) & (month_codes >= 0)
+    new_customers = np.bincount(
+        state_codes[known].astype(np.int64) * len(all_months) + month_codes[known],
+        minlength=len(all_states) * len(all_months)
+    ).reshape(len(all_states), len(all_months))
+    cumulative_customers = new_customers.cumsum(axis=1)
+
+    # States without customers yet are padded with 1 to stay visible on the log axis
+    cumulative_data = pd.DataFrame({
+        'customer_state_full': np.tile(all_states, len(all_months)),
+        'cumulative_customers': np.where(cumulative_customers == 0, 1, cumulative_customers).T.ravel(),
+        'month_year': np.repeat(all_months, len(all_states))
+    })
+    cumulative_data = cumulative_data.sort_values(by=['month_year', 'cumulative_customers'])
+
+    fig14 = px.bar(
+        cumulative_data,
+        x='cumulative_customers',
+        y='customer_state_full',
+        orientation='h',
+        color='customer_state_full',
+        animation_frame='month_year',
+        animation_group='customer_state_full',
+        title='Cumulative Customer Growth by State (Log Scale)',
+        log_x=True,
+        labels={'cumulative_customers': 'Cumulative Customers (Log Scale)', 'customer_state_full': 'Customer State'}
+    )
+    fig14.update_layout(
+        xaxis_range=[np.log10(1), np.log10(cumulative_data['cumulative_customers'].max()) * 1.05],
+        showlegend = False,
+        xaxis_title = None,
+        xaxis=dict(showticklabels=False)
+    )
+    fig14.update_layout(title_x=0.5)
+    fig14.update_layout(
+        sliders=[{
+            'currentvalue': {
+                'prefix': '',
+                'font': {'size': 12}
+            }
+        }]
+    )
+    return fig14
+
+def fig15(tables, geojson, args):
+    avg_price_data = tables["avg_price_data"]
+
+    # Create formatted label for display only
+    avg_price_data['price_label'] = avg_price_data['price'].round(2).apply(lambda x: f"${x}")
+
+    fig15 = px.bar(
+        avg_price_data,
+        x='num_items',
+        y='price',
+        color='price',
+        color_continuous_scale='Plasma',
+        text='price_label',               # display label with dollar sign
+        hover_data={'price_label': False, 'price': ':.2f'},  # hide label; format price nicely
+        title='Average Item Price Based On Number Of Items Purchased',
+        labels={'num_items': 'Number of Items Purchased', 'price': 'Average Item Price ($)'}
+    )
+
+    fig15.update_traces(textposition='outside')
+    fig15.update_xaxes(type='category')
+
+    fig15.update_layout(
+        title_x=0.5,
+        uniformtext_minsize=8,
+        uniformtext_mode='hide',
+        margin=dict(t=75),
+        coloraxis_colorbar=dict(
+            title=dict(
+                text="Avg Item Price ($)",
+                side="right",
+                font=dict(size=12)
+            )
+        )
+    )
+    return fig15
+
+def fig16(tables, geojson, args):
+    status_counts = tables["status_counts"]
+    status_df = (
+        status_counts.query("order_status != 'delivered'")
+          .assign(order_status_cap=lambda x: x['order_status'].str.capitalize())
+          .reset_index(drop=True)
+    )
+
+    fig16 = px.pie(
+        status_df,
+        names='order_status_cap',
+        values='count',
+        title='Order Status Distribution Excluding Delivered Orders',
+        color='order_status_cap',
+        color_discrete_sequence=px.colors.qualitative.Bold
+    )
+
+    fig16.update_traces(
+        textposition='inside',
+        textinfo='label+percent',
+        textfont=dict(size=11),                        # smaller label text
+        pull=0.03,
+        rotation=90,
+        hovertemplate="Order Status: %{label}<br>Percent: %{percent}<extra></extra>"
+    )
+
+    fig16.update_layout(
+        title_x=0.5,
+        margin=dict(t=80, b=30, l=30, r=30),
+        showlegend=False
+    )
+    return fig16
+
+def fig17(tables, geojson, args):
+    # Average CLV by state
+    state_stats = tables["state_stats"]
+
+    fig17 = px.choropleth(
+        state_stats,
+        geojson=geojson,
+        locations="customer_state",
+        featureidkey="properties.sigla",
+        color="avg_clv",
+        color_continuous_scale="RdBu_r",
+        scope="world",
+        title="Average Customer Lifetime Value by State",
+        hover_name="customer_state_full",
+        hover_data={},
+    )
+
+    fig17.update_traces(
+        hovertemplate="<b>%{customdata[0]}</b><br>Average CLV: $%{customdata[1]:,.2f}<extra></extra>",
+        customdata=state_stats[["customer_state_full", "avg_clv"]].to_numpy()
+    )
+
+    fig17.update_geos(
+        fitbounds="locations",
+        visible=False,
+        lataxis_range=[-38, 10],
+        lonaxis_range=[-78, -30]
+    )
+
+    fig17.update_layout(margin={"r":0,"t":50,"l":0,"b":0},
+        coloraxis_colorbar=dict(
+            title=dict(
+                text="Avg CLV ($)", 
+                side="right",              
+                font=dict(size=12)
+            ), x = 0.85
+        ), title_x=0.5)
+    return fig17
+
+def fig18(tables, geojson, args):
+    state_stats = tables["state_stats"]
+
+    fig18 = px.choropleth(
+        state_stats,
+        geojson=geojson,
+        locations="customer_state",
+        featureidkey="properties.sigla",
+        color="orders_count",
+        color_continuous_scale="RdBu_r",
+        scope="world",
+        title="Total Orders by State",
+        hover_name="customer_state_full",
+        hover_data={},
+    )
+
+    fig18.update_traces(
+        hovertemplate="<b>%{customdata[0]}</b><br>Orders Count: %{customdata[1]}<extra></extra>",
+        customdata=state_stats[["customer_state_full", "orders_count"]].to_numpy()
+    )
+
+    fig18.update_geos(
+        fitbounds="locations",
+        visible=False,
+        lataxis_range=[-38, 10],
+        lonaxis_range=[-78, -30]
+    )
+
+    fig18.update_layout(margin={"r":0,"t":50,"l":0,"b":0},
+        coloraxis_colorbar=dict(
+            title=dict(
+                text="Total Orders", 
+                side="right",              
+                font=dict(size=12)
+            ), x = 0.85
+        ), title_x=0.5)
+    return fig18
+
+# The histogram pages load plotly.js from the CDN; the rest inline it, or share
+# one copy in ../assets/ with --shared-assets. With --json-figures every page is
+# a plotly JSON spec instead, with its config, drawn by the ../dashboard.html loader
+histogram_pages = ["fig1", "fig2", "fig3", "fig4", "fig5"]
+
+# --precision rounds every float array of the traces (animation frames included)
+# to that many decimals and stores it as a base64 typed array: integers of the
+# smallest width when every value is whole, float32 when that holds the rounded
+# values exactly, float64 otherwise (float32 approximations would show up in
+# the hover labels). Typed arrays are plotly.js's {"dtype", "bdata"} specs
+typed_array_dtypes = {"int8": "i1", "int16": "i2", "int32": "i4", "float32": "f4", "float64": "f8"}
+# GeoJSON, map layers and axis ranges stay plain JSON, as plotly.py leaves them
+typed_array_skipped_keys = ("geojson", "layer", "layers", "range")
+
+def typed_array(values, decimals):
+    rounded = np.round(values, decimals)
+    finite = np.isfinite(rounded).all()
+    if finite and (rounded == np.trunc(rounded)).all() and np.abs(rounded).max(initial=0) < 2 ** 31:
+        dtype = next(dtype for dtype in ("int8", "int16", "int32")
+                     if np.iinfo(dtype).min <= rounded.min() and rounded.max() <= np.iinfo(dtype).max)
+        values = rounded.astype(dtype)
+    elif np.array_equal(rounded.astype("float32"), rounded, equal_nan=True):
+        values = rounded.astype("float32")
+    else:
+        values = rounded.astype("float64")
+    spec = {"dtype": typed_array_dtypes[values.dtype.name],
+            "bdata": base64.b64encode(np.ascontiguousarray(values)).decode("ascii")}
+    if values.ndim > 1:
+        spec["shape"] = ", ".join(str(size) for size in values.shape)
+    return spec
+
+def float_arrays(properties, path=()):
+    for key, value in properties.items():
+        if key in typed_array_skipped_keys:
+            continue
+        if isinstance(value, dict):
+            yield from float_arrays(value, path + (key,))
+        elif isinstance(value, np.ndarray) and value.dtype.kind == "f" and value.size:
+            yield path + (key,), value
+        elif isinstance(value, (list, tuple)) and value and all(isinstance(v, float) for v in value):
+            yield path + (key,), np.asarray(value)
+
+def trim_precision(fig, decimals):
+    for trace in list(fig.data) + [trace for frame in fig.frames for trace in frame.data]:
+        for path, values in list(float_arrays(trace.to_plotly_json())):
+            trace[path] = typed_array(values, decimals)
+    return fig
+
+# --delta-frames rewrites an animation so each frame only holds the trace
+# properties that changed since the previous one and names that frame as its
+# baseframe. plotly.js merges a frame onto its chain of baseframes before
+# animating to it, so scrubbing to any month still draws that month's full
+# state, while the labels, colours and axes of every state are stored once in
+# the traces. The first frame is the keyframe, holding every property that
+# varies along the animation.
+def flat_properties(properties, path=()):
+    flat = {}
+    for key, value in properties.items():
+        if isinstance(value, dict) and "bdata" not in value:
+            flat.update(flat_properties(value, path + (key,)))
+        else:
+            flat[path + (key,)] = value
+    return flat
+
+def nested_properties(flat):
+    properties = {}
+    for path, value in flat.items():
+        node = properties
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = value
+    return properties
+
+def compact(value):
+    # A single value is shorter as a JSON list than as a base64 typed array
+    return value.tolist() if isinstance(value, np.ndarray) and value.size == 1 else value
+
+def delta_frames(fig):
+    # Property states by trace index. fig.data only holds the traces of the
+    # first frame, so a trace that a later frame adds is seeded from the frame
+    # that first defines it
+    state = {
+        index: {path: (value, pio.json.to_json_plotly(value))
+                for path, value in flat_properties(trace.to_plotly_json()).items()}
+        for index, trace in enumerate(fig.data)
+    }
+    initial = {index: dict(properties) for index, properties in state.items()}
+    types = {index: trace.type for index, trace in enumerate(fig.data)}
+
+    # Properties of each frame with their serialization to compare them, the
+    # (trace, property) pairs that change at some point of the animation and
+    # the frame each trace missing from fig.data first appears in
+    frames, varying, first_defined = [], set(), {}
+    for number, frame in enumerate(fig.frames):
+        indices = frame.traces if frame.traces is not None else range(len(frame.data))
+        changes = {}
+        for index, trace in zip(indices, frame.data):
+            properties = {path: (value, pio.json.to_json_plotly(value))
+                          for path, value in flat_properties(trace.to_plotly_json()).items()}
+            if index not in state:
+                state[index], types[index], first_defined[index] = dict(properties), trace.type, number
+            for path, value in properties.items():
+                if state[index].get(path, (None, None))[1] != value[1]:
+                    varying.add((index, path))
+                    state[index][path] = value
+            changes[index] = properties
+        frames.append(changes)
+
+    delta, previous = [], {}
+    for number, (frame, changes) in enumerate(zip(fig.frames, frames)):
+        data = {}
+        if number == 0:
+            # State after the first frame of every property that varies
+            for index, path in sorted(varying, key=str):
+                value = changes.get(index, {}).get(path) or initial.get(index, {}).get(path)
+                if value is None:
+                    continue
+                data.setdefault(index, {})[path] = compact(value[0])
+                previous[(index, path)] = value
+        for index, properties in changes.items():
+            # A trace missing from fig.data is written whole in its first frame
+            added = first_defined.get(index) == number
+            for path, value in properties.items():
+                if added or ((index, path) in varying and previous.get((index, path), (None, None))[1] != value[1]):
+                    data.setdefault(index, {})[path] = compact(value[0])
+                    previous[(index, path)] = value
+        delta.append(go.Frame(
+            name=frame.name,
+            data=[{"type": types[index], **nested_properties(data[index])} for index in sorted(data)],
+            traces=sorted(data),
+            baseframe=fig.frames[number - 1].name if number else None,
+            layout=frame.layout,
+        ))
+    fig.frames = delta
+    return fig
+
+def write_page(name, fig, args, shared_geojson):
+    filename = f"{name}.json" if args.json_figures else f"{name}.html"
+    if args.precision is not None:
+        trim_precision(fig, args.precision)
+    if args.delta_frames and fig.frames:
+        delta_frames(fig)
+    if shared_geojson:
+        # The choropleths then fetch the GeoJSON by URL, relative to the page
+        # drawing them (the loader page sits one level above ../assets/)
+        url = "assets/brazil-states.geojson" if args.json_figures else "brazil-states.geojson"
+        fig.update_traces(geojson=url, selector=dict(type="choropleth"))
+    if args.json_figures:
+        spec = fig.to_plotly_json()
+        spec["config"] = {"responsive": True} if name in histogram_pages else {"displayModeBar": False, "responsive": True}
+        with open(fr"../assets/{filename}", "w", encoding="utf-8") as f:
+            f.write(pio.to_json(spec, validate=False))
+    elif name in histogram_pages:
+        fig.write_html(fr"../assets/{filename}", include_mathjax=False, include_plotlyjs='cdn')
+    else:
+        # This keeps the graph interactive but removes the heavy modebar to look cleaner
+        fig.write_html(fr"../assets/{filename}", config={'displayModeBar': False},
+                       include_plotlyjs="directory" if args.shared_assets else True)
+    if args.compress:
+        compress_siblings(fr"../assets/{filename}")
+    print(f"Saved assets/{filename}")
+
+# Builds and writes one page. Parallel builds run this in worker processes that
+# get the GeoJSON once through init_worker and only the tables the figure reads
+worker_geojson = None
+
+def init_worker(geojson, trace_memory=False):
+    global worker_geojson
+    worker_geojson = geojson
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+# The figure and everything it was built from are released before returning,
+# so only one page's worth of objects is alive at a time. Returns the page
+# and, when tracing, the peak memory it took above what was held before
+def build_page(name, tables, args, shared_geojson):
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    fig = globals()[name](tables, worker_geojson, args)
+    write_page(name, fig, args, shared_geojson)
+    # Plotly traces point back at their figure, so the cycle needs collecting
+    del fig
+    gc.collect()
+    return name, tracemalloc.get_traced_memory()[1] - baseline if tracing else None
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import requests
+
+
+def _sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_geojson(url, cache_path, timeout=30):
+    # The GeoJSON is cached on disk with a sidecar recording its source URL and
+    # sha256, so later runs (and offline builds) read it from there. A cache
+    # whose fingerprint doesn't match is downloaded again.
+    fingerprint_path = cache_path + ".json"
+    if os.path.exists(cache_path) and os.path.exists(fingerprint_path):
+        with open(fingerprint_path) as f:
+            fingerprint = json.load(f)
+        if fingerprint.get("url") == url and fingerprint.get("sha256") == _sha256(cache_path):
+            with open(cache_path, encoding="utf-8") as f:
+                return json.load(f)
+        print(f"Cached GeoJSON {cache_path} doesn't match its fingerprint, downloading it again")
+
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    geojson = response.json()
+
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    with open(cache_path, "wb") as f:
+        f.write(response.content)
+    with open(fingerprint_path, "w") as f:
+        json.dump({"url": url, "sha256": _sha256(cache_path)}, f)
+    return geojson
+
+
+def _douglas_peucker(points, tolerance):
+    # Boolean mask of the points kept, always including both ends
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        inner = points[start + 1:end]
+        chord = points[end] - points[start]
+        offsets = inner - points[start]
+        length = np.hypot(*chord)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack += [(start, split), (split, end)]
+    return keep
+
+
+def _rings(geometry):
+    if geometry["type"] == "Polygon":
+        return [ring for ring in geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return [ring for polygon in geometry["coordinates"] for ring in polygon]
+    return []
+
+
+def simplify_geojson(geojson, tolerance):
+    # Douglas-Peucker simplification that keeps shared borders shared: rings are
+    # cut at junctions (vertices where the set of features owning a vertex
+    # changes) and every arc between two junctions is simplified once, in a
+    # canonical direction, so neighbouring states keep identical borders.
+    features = geojson["features"]
+    rings, ring_features = [], []
+    for i, feature in enumerate(features):
+        for ring in _rings(feature["geometry"]):
+            rings.append(np.asarray(ring, dtype="float64")[:, :2])
+            ring_features.append(i)
+
+    # Feature sets owning each distinct vertex
+    lengths = np.array([len(ring) for ring in rings])
+    coords = np.concatenate(rings)
+    vertex_ids, vertices = pd.factorize(pd.MultiIndex.from_arrays([coords[:, 0], coords[:, 1]]))
+    owners = pd.DataFrame({"vertex": vertex_ids, "feature": np.repeat(ring_features, lengths)}).drop_duplicates()
+    owner_sets = owners.sort_values("feature").groupby("vertex")["feature"].agg(tuple)
+    signature = pd.factorize(owner_sets)[0][vertex_ids]
+
+    simplified_arcs = {}
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    new_rings = []
+    for r, ring in enumerate(rings):
+        ids = vertex_ids[offsets[r]:offsets[r + 1]][:-1]
+        sig = signature[offsets[r]:offsets[r + 1]][:-1]
+        if len(ids) < 4:
+            new_rings.append(ring.tolist())
+            continue
+        junctions = np.flatnonzero((sig != np.roll(sig, 1)) | (sig != np.roll(sig, -1)))
+        if len(junctions) == 0:
+            # A ring with no junction starts at its smallest vertex id, so a
+            # neighbour tracing the same ring cuts it at the same place
+            junctions = np.array([int(np.argmin(ids))])
+        start = junctions[0]
+        ids = np.roll(ids, -start)
+        junctions = np.append(junctions - start, len(ids))
+
+        kept = []
+        for a, b in zip(junctions[:-1], junctions[1:]):
+            arc = np.append(ids[a:b], ids[b % len(ids)])
+            forward = arc[0] < arc[-1] or (arc[0] == arc[-1] and arc[1] <= arc[-2])
+            key = tuple(arc if forward else arc[::-1])
+            if key not in simplified_arcs:
+                points = np.asarray(vertices[list(key)].tolist())
+                simplified_arcs[key] = np.asarray(key)[_douglas_peucker(points, tolerance)]
+            arc_kept = simplified_arcs[key] if forward else simplified_arcs[key][::-1]
+            kept.extend(arc_kept[:-1])
+        kept.append(kept[0])
+
+        if len(kept) < 4:
+            new_rings.append(ring.tolist())
+        else:
+            new_rings.append(np.asarray(vertices[kept].tolist()).tolist())
+
+    # Put the rings back in their geometries
+    rings_iter = iter(new_rings)
+    simplified = {**geojson, "features": []}
+    for feature in features:
+        geometry = feature["geometry"]
+        if geometry["type"] == "Polygon":
+            coordinates = [next(rings_iter) for _ in geometry["coordinates"]]
+        elif geometry["type"] == "MultiPolygon":
+            coordinates = [[next(rings_iter) for _ in polygon] for polygon in geometry["coordinates"]]
+        else:
+            coordinates = geometry["coordinates"]
+        simplified["features"].append({**feature, "geometry": {**geometry, "coordinates": coordinates}})
+    return simplified
@@ -0,0 +1,249 @@
+import argparse
+import functools
+import http.server
+import json
+import os
+import time
+import urllib.parse
+import numpy as np
+import pandas as pd
+from plotly.offline import get_plotlyjs
+import figures
+from aggregates import Partials, TimeCube, load_enriched, state_map
+from catalog import (figure_columns, dictionary_columns, figure_inputs, enriched_key, parquet_path, build_dir,
+                     geojson_url, geojson_path)
+from geo import load_geojson, simplify_geojson
+
+# Serves the dashboard figures on localhost as plotly JSON, for any range of
+# purchase months, set of customer states and delivered orders only. The
+# enriched frame stays in memory with the filter columns as numpy arrays; a
+# filter selects its rows with a mask and folds them into the same tables the
+# static build draws (the distinct counts, customer lifetime values and items
+# per order don't split by state and month, so the rows are folded again rather
+# than summed from smaller aggregates). The temporal figures only need the time
+# cube, which is built once and sliced by state and month instead. Tables and
+# figure JSON are kept in LRU caches keyed by the normalized filter, so a
+# repeated query is a dict lookup.
+
+page = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Olist E-commerce Dashboard</title>
+<script src="/plotly.min.js"></script>
+<style>
+  body { font-family: sans-serif; margin: 1em; }
+  form { display: flex; gap: 1em; align-items: end; flex-wrap: wrap; }
+  label { display: flex; flex-direction: column; font-size: 0.9em; }
+  #status { color: #666; margin: 0.5em 0; }
+</style>
+</head>
+<body>
+<form id="filter">
+  <label>Figure <select name="figure"></select></label>
+  <label>From month <input name="start" type="month"></label>
+  <label>To month <input name="end" type="month"></label>
+  <label>States (e.g. SP,RJ) <input name="states"></label>
+  <label><span>Delivered only</span><input name="delivered" type="checkbox" value="1"></label>
+  <button>Show</button>
+</form>
+<div id="status"></div>
+<div id="figure" style="height: 80vh"></div>
+<script>
+  const form = document.getElementById("filter");
+  const status = document.getElementById("status");
+
+  async function show(event) {
+    if (event) event.preventDefault();
+    const data = new FormData(form);
+    const name = data.get("figure");
+    data.delete("figure");
+    const started = performance.now();
+    const response = await fetch(`/figures/${name}?${new URLSearchParams(data)}`);
+    const body = await response.json();
+    if (!response.ok) {
+      status.textContent = body.error;
+      return;
+    }
+    await Plotly.react("figure", body.data, body.layout, {displayModeBar: false, responsive: true});
+    status.textContent = `${name} in ${Math.round(performance.now() - started)} ms`;
+  }
+
+  fetch("/figures").then(response => response.json()).then(names => {
+    form.figure.innerHTML = names.map(name => `<option>${name}</option>`).join("");
+    show();
+  });
+  form.addEventListener("submit", show);
+</script>
+</body>
+</html>
+"""
+
+
+def normalize_filter(query):
+    # A hashable filter from query string parameters: (first month ordinal,
+    # last month ordinal, sorted state codes, delivered only)
+    def month(name):
+        value = query.get(name, [""])[0]
+        if not value:
+            return None
+        try:
+            return pd.Period(value, freq="M").ordinal
+        except ValueError:
+            raise ValueError(f"{name} must be a month like 2017-06, not {value!r}")
+
+    states = {state.strip().upper() for value in query.get("states", []) for state in value.split(",")} - {""}
+    unknown = states - set(state_map)
+    if unknown:
+        raise ValueError(f"unknown states: {', '.join(sorted(unknown))}")
+    delivered = query.get("delivered", [""])[0].lower() in ("1", "true", "yes", "on")
+    return month("start"), month("end"), tuple(sorted(states)), delivered
+
+
+# Figures drawn from time cube tables alone. The cube has no order status, so
+# they are refolded like the others when only delivered orders are asked for
+cube_tables = {"hourly_pivot", "delivery_trend", "orders_monthly", "state_month_sales", "state_order"}
+cube_figures = {name for name, inputs in figure_inputs.items() if set(inputs) <= cube_tables}
+
+
+class Dashboard:
+
+    def __init__(self, frame, geojson, cache_size=256):
+        self.frame = frame
+        self.geojson = geojson
+        self.months = frame["month_ordinal"].to_numpy("float64", na_value=np.nan)
+        self.delivered = (frame["order_status"] == "delivered").to_numpy()
+        self.cube = TimeCube.from_cells(TimeCube.cells(frame))
+        self.states = set(frame["customer_state"].dropna().astype(str))
+        # Figure builders only read args.raw_histograms
+        self.options = argparse.Namespace(raw_histograms=False, shared_assets=False)
+        self.tables = functools.lru_cache(maxsize=32)(self._tables)
+        self.cube_tables_for = functools.lru_cache(maxsize=32)(self._cube_tables)
+        self.figure_json = functools.lru_cache(maxsize=cache_size)(self._figure_json)
+
+    def _tables(self, key):
+        start, end, states, delivered = key
+        mask = np.ones(len(self.frame), dtype=bool)
+        if start is not None:
+            mask &= self.months >= start
+        if end is not None:
+            mask &= self.months <= end
+        if states:
+            mask &= self.frame["customer_state"].isin(states).to_numpy()
+        if delivered:
+            mask &= self.delivered
+        if not mask.any():
+            return None
+        return Partials.fold(self.frame[mask]).close_orders().tables()
+
+    def _cube_tables(self, key):
+        start, end, states, _ = key
+        cube = self.cube.select(list(states) if states else None, start, end)
+        num_items = cube.measure("num_items").sum(axis=(1, 2, 3))
+        if start is None and end is None:
+            # Rows without a purchase month aren't in the cube but still select their states
+            present = set(states) & self.states if states else self.states
+            if states and not present or not len(self.frame):
+                return None
+        else:
+            present = {state for state, count in zip(cube.states, num_items) if count}
+            if not num_items.any():
+                return None
+        return {
+            **cube.tables(),
+            "state_order": [name for state, name in state_map.items() if state in present],
+        }
+
+    def _figure_json(self, name, key):
+        if name in cube_figures and not key[3]:
+            tables = self.cube_tables_for(key)
+        else:
+            tables = self.tables(key)
+        if tables is None:
+            return None
+        return getattr(figures, name)(tables, self.geojson, self.options).to_json()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    dashboard = None
+
+    def send(self, status, body, content_type="application/json", headers=()):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for header, value in headers:
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, status, message):
+        self.send(status, json.dumps({"error": message}))
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/":
+            self.send(200, page, "text/html; charset=utf-8")
+        elif url.path == "/plotly.min.js":
+            self.send(200, plotly_js(), "application/javascript", [("Cache-Control", "max-age=86400")])
+        elif url.path == "/figures":
+            self.send(200, json.dumps(list(figure_inputs)))
+        elif url.path.startswith("/figures/"):
+            name = url.path[len("/figures/"):]
+            if name not in figure_inputs:
+                return self.error(404, f"unknown figure {name!r}")
+            try:
+                key = normalize_filter(urllib.parse.parse_qs(url.query))
+            except ValueError as e:
+                return self.error(400, str(e))
+            started = time.perf_counter()
+            try:
+                body = self.dashboard.figure_json(name, key)
+            except Exception as e:
+                # Answered rather than dropping the connection, and logged
+                self.log_error("building %s for %s failed: %r", name, key, e)
+                return self.error(500, f"could not build {name}: {e}")
+            if body is None:
+                return self.error(404, "no orders match the filter")
+            elapsed = (time.perf_counter() - started) * 1000
+            self.send(200, body, headers=[("Server-Timing", f"figure;dur={elapsed:.1f}")])
+        else:
+            self.error(404, f"no such path {url.path!r}")
+
+
+@functools.cache
+def plotly_js():
+    # Bundled with the plotly package, so the page works offline
+    return get_plotlyjs().encode()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the dashboard figures with filters on localhost")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--cache-size", type=int, default=256,
+                        help="figures (per filter) kept in the LRU cache")
+    parser.add_argument("--simplify", type=float, metavar="TOLERANCE",
+                        help="simplify the state borders with Douglas-Peucker at this tolerance in degrees")
+    args = parser.parse_args()
+
+    # The same memory-mapped enriched frame as the static build, built on first use
+    columns = list(dict.fromkeys(col for cols in figure_columns.values() for col in cols))
+    frame = load_enriched(parquet_path, columns, dictionary_columns, os.path.join(build_dir, "enriched.arrow"),
+                          enriched_key(parquet_path, columns))
+
+    try:
+        geojson = load_geojson(geojson_url, geojson_path)
+        if args.simplify:
+            geojson = simplify_geojson(geojson, args.simplify)
+    except Exception as e:
+        print(f"Error loading GeoJSON, the choropleths will have no state borders: {e}")
+        geojson = None
+
+    Handler.dashboard = Dashboard(frame, geojson, args.cache_size)
+    server = http.server.HTTPServer((args.host, args.port), Handler)
+    print(f"Serving the dashboard on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
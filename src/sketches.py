@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+
+def _bit_length(values):
+    # Number of significant bits of each uint64, without a float round trip
+    values = values.copy()
+    lengths = np.zeros(len(values), dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >= np.uint64(1 << shift)
+        lengths[high] += shift
+        values[high] >>= np.uint64(shift)
+    return lengths + (values > 0)
+
+
+def _hash(values):
+    values = pd.Series(values).dropna()
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+
+class HyperLogLog:
+    # Approximate distinct count over 2**precision one-byte registers. The
+    # relative standard error is about 1.04 / sqrt(2**precision) and two
+    # sketches of the same precision merge by taking the register maximum,
+    # so sketches built per batch or partition add up to the sketch of the whole.
+
+    def __init__(self, precision, registers=None):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+
+    @staticmethod
+    def precision_for(error):
+        return int(np.clip(np.ceil(np.log2((1.04 / error) ** 2)), 4, 18))
+
+    @staticmethod
+    def _slots(values, precision):
+        hashes = _hash(values)
+        index = (hashes >> np.uint64(64 - precision)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - precision)) - 1)
+        rank = (64 - precision + 1) - _bit_length(rest)
+        return index, rank
+
+    @classmethod
+    def grouped(cls, keys, values, precision):
+        # One sketch per distinct key, filled in a single pass
+        keys = pd.Series(np.asarray(keys), dtype=object)
+        values = pd.Series(values).reset_index(drop=True)
+        present = values.notna().to_numpy() & keys.notna().to_numpy()
+        codes, uniques = pd.factorize(keys[present])
+        index, rank = cls._slots(values[present], precision)
+        registers = np.zeros((len(uniques), 1 << precision), dtype=np.uint8)
+        np.maximum.at(registers, (codes, index), rank)
+        return {key: cls(precision, registers[i]) for i, key in enumerate(uniques)}
+
+    def update(self, values):
+        index, rank = self._slots(values, self.precision)
+        np.maximum.at(self.registers, index, rank)
+        return self
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("cannot merge sketches of different precision")
+        return HyperLogLog(self.precision, np.maximum(self.registers, other.registers))
+
+    @classmethod
+    def union(cls, sketches):
+        sketches = list(sketches)
+        return cls(sketches[0].precision, np.maximum.reduce([sketch.registers for sketch in sketches]))
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        # Linear counting is more accurate while many registers are still empty
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
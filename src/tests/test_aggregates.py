@@ -0,0 +1,244 @@
+import os
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import aggregates
+from aggregates import (Partials, enrich, enrich_table, parallel_partials, state_map, stream_partials,
+                        write_month_partitions)
+from catalog import dictionary_columns
+
+
+def merged_items(n_orders=400, seed=0):
+    # An item-level frame shaped like the merged parquet, with missing dates
+    # (purchase timestamps included) and states
+    rng = np.random.default_rng(seed)
+    ids = lambda n, prefix: np.array([f"{prefix}{i:031x}" for i in rng.integers(0, 2 ** 40, n)])
+    counts = rng.choice([1, 1, 1, 2, 3], n_orders)
+    order = np.repeat(np.arange(n_orders), counts)
+    purchase = pd.Timestamp("2017-01-01") + pd.to_timedelta(rng.integers(0, 400 * 86_400, n_orders), unit="s")
+    carrier = purchase + pd.to_timedelta(rng.integers(3_600, 8 * 86_400, n_orders), unit="s")
+    delivered = carrier + pd.to_timedelta(rng.integers(3_600, 20 * 86_400, n_orders), unit="s")
+    status = rng.choice(["delivered", "shipped", "canceled", "invoiced"], n_orders, p=[0.85, 0.05, 0.05, 0.05])
+    customers = ids(n_orders // 2, "c")
+    states = rng.choice(list(state_map)[:8] + [None], n_orders)
+    frame = pd.DataFrame({
+        "order_id": ids(n_orders, "o")[order],
+        "order_item_id": np.concatenate([np.arange(1, count + 1) for count in counts]),
+        "customer_unique_id": customers[rng.integers(0, len(customers), n_orders)][order],
+        "customer_city": rng.choice(["a", "b", "c", "d"], n_orders)[order],
+        "customer_state": states[order],
+        "customer_zip_code_prefix": rng.integers(1_000, 1_050, n_orders)[order],
+        "order_status": status[order],
+        "order_purchase_timestamp": purchase[order],
+        "order_delivered_carrier_date": pd.Series(carrier).where(status != "invoiced").to_numpy()[order],
+        "order_delivered_customer_date": pd.Series(delivered).where(status == "delivered").to_numpy()[order],
+        "order_estimated_delivery_date": (purchase + pd.Timedelta(days=15)).normalize()[order],
+        "shipping_limit_date": purchase[order] + pd.to_timedelta(rng.integers(86_400, 5 * 86_400, len(order)), unit="s"),
+        "product_id": ids(50, "p")[rng.integers(0, 50, len(order))],
+        "seller_id": ids(10, "s")[rng.integers(0, 10, len(order))],
+        "price": np.round(rng.lognormal(4, 1, len(order)), 2),
+        "freight_value": np.round(rng.lognormal(2.5, 0.5, len(order)), 2),
+    })
+    unknown_purchase = np.repeat(rng.random(n_orders) < 0.02, counts)
+    for col in ["order_purchase_timestamp", "shipping_limit_date", "order_estimated_delivery_date"]:
+        frame[col] = frame[col].mask(unknown_purchase)
+    for col in [col for col in dictionary_columns if col in frame]:
+        frame[col] = frame[col].astype("category")
+    return frame
+
+
+merged_columns = list(merged_items(n_orders=2).columns)
+
+
+def items(n_orders=400, seed=0):
+    return enrich(merged_items(n_orders, seed))
+
+
+def fold_frame(frame, precision=None):
+    return Partials.fold(frame, precision)
+
+
+def fold_arrow(frame, precision=None):
+    # The same rows through the Arrow backend, from the merged columns
+    table = pa.Table.from_pandas(frame[merged_columns], preserve_index=False)
+    return Partials.fold_table(enrich_table(table), precision)
+
+
+folds = pytest.mark.parametrize("fold", [fold_frame, fold_arrow], ids=["pandas", "arrow"])
+
+
+def assert_tables_equal(left, right):
+    assert left.keys() == right.keys()
+    for name in left:
+        a, b = left[name], right[name]
+        if name == "customers":
+            pd.testing.assert_frame_equal(a.sort_index(), b.sort_index())
+        elif name == "histograms":
+            assert a.keys() == b.keys()
+            for col in a:
+                pd.testing.assert_series_equal(a[col], b[col])
+        elif isinstance(a, pd.DataFrame):
+            pd.testing.assert_frame_equal(a, b)
+        elif isinstance(a, pd.Series):
+            pd.testing.assert_series_equal(a, b)
+        else:
+            assert a == b, name
+
+
+def splits(length):
+    # Contiguous cuts, including ones through the middle of an order, and an
+    # interleaved split
+    for cut in [1, length // 3, length // 2 + 1, length - 1]:
+        yield [slice(0, cut), slice(cut, length)]
+    yield [slice(0, length, 2), slice(1, length, 2)]
+    yield [slice(0, length // 4), slice(length // 4, length // 2), slice(length // 2, length)]
+
+
+@folds
+@pytest.mark.parametrize("precision", [None, 10])
+def test_fold_of_the_whole_equals_the_combined_folds_of_any_split(fold, precision):
+    frame = items()
+    whole = fold(frame, precision).close_orders().tables()
+    for parts in splits(len(frame)):
+        combined = Partials.combine(fold(frame.iloc[part], precision) for part in parts)
+        assert_tables_equal(combined.close_orders().tables(), whole)
+
+
+@pytest.mark.parametrize("precision", [None, 10])
+def test_both_backends_fold_to_the_same_tables(precision):
+    frame = items(seed=3)
+    arrow, pandas = (fold(frame, precision).close_orders().tables() for fold in [fold_arrow, fold_frame])
+    # The Arrow fold keeps the customer states as strings rather than categories
+    states = pandas["customers"]["state"]
+    pandas["customers"]["state"] = states.astype(object).where(states.notna(), None)
+    assert_tables_equal(arrow, pandas)
+
+
+@folds
+def test_combine_is_order_independent(fold):
+    frame = items(seed=1)
+    a, b, c = (fold(frame.iloc[part]) for part in [slice(0, 100), slice(100, 300), slice(300, None)])
+    assert_tables_equal(Partials.combine([a, b, c]).close_orders().tables(),
+                        Partials.combine([c, a, b]).close_orders().tables())
+
+
+@folds
+def test_closing_orders_at_order_boundaries(fold):
+    # Closing each part before combining is exact when no order spans parts
+    frame = items(seed=2)
+    boundary = int(np.flatnonzero(frame["order_item_id"].to_numpy() == 1)[len(frame) // 6])
+    parts = [frame.iloc[:boundary], frame.iloc[boundary:]]
+    combined = Partials.combine(fold(part).close_orders() for part in parts)
+    assert_tables_equal(combined.tables(), fold(frame).close_orders().tables())
+
+
+@folds
+def test_rows_without_a_state_are_counted_in_the_totals(fold):
+    frame = items()
+    orders = frame[frame["order_item_id"] == 1]
+    assert frame["customer_state"].isna().any()
+    tables = fold(frame).close_orders().tables()
+    for col in ["diff_delivered_carrier", "diff_delivered_ordered", "diff_carrier_ordered"]:
+        assert tables["histograms"][col].sum() == orders[col].notna().sum()
+    assert tables["histograms"]["diff_carrier_limit"].sum() == frame["diff_carrier_limit"].notna().sum()
+    assert tables["summary"]["unique_orders"] == frame["order_id"].nunique()
+    # The monthly figures only cover orders with a purchase date
+    assert tables["orders_monthly"]["num_orders"].sum() == orders["month_ordinal"].notna().sum()
+    # The per-state stats only cover known states
+    assert "" not in set(tables["state_stats"]["customer_state"])
+    assert tables["state_stats"]["orders_count"].sum() == orders["customer_state"].notna().sum()
+
+
+@pytest.fixture
+def shared_blocks(monkeypatch):
+    # Names of the shared memory blocks parallel_partials creates
+    names = []
+
+    class Recorded(shared_memory.SharedMemory):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            if kwargs.get("create"):
+                names.append(self.name)
+
+    monkeypatch.setattr(aggregates.shared_memory, "SharedMemory", Recorded)
+    return names
+
+
+def assert_unlinked(names):
+    assert names
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+
+@pytest.mark.parametrize("backend", ["pandas", "arrow"])
+def test_parallel_folds_equal_one_fold(backend, shared_blocks):
+    table = pa.Table.from_pandas(items(seed=4), preserve_index=False)
+    # Orders straddle the row ranges of the three workers
+    bounds = np.linspace(0, table.num_rows, 4).astype(np.int64)[1:-1]
+    assert (table["order_item_id"].to_numpy()[bounds] > 1).any()
+    if backend == "arrow":
+        whole = Partials.fold_table(table).close_orders()
+    else:
+        whole = Partials.fold(table.to_pandas()).close_orders()
+    assert_tables_equal(parallel_partials(table, 3, backend=backend).tables(), whole.tables())
+    assert_unlinked(shared_blocks)
+
+
+def test_parallel_folds_free_the_block_when_a_worker_fails(shared_blocks):
+    table = pa.Table.from_pandas(items(n_orders=50), preserve_index=False)
+    with pytest.raises(Exception):
+        parallel_partials(table, 2, precision="not a precision")
+    assert_unlinked(shared_blocks)
+
+
+@pytest.mark.parametrize("backend", ["pandas", "arrow"])
+def test_streamed_month_partitions_equal_one_fold(backend, tmp_path):
+    # Orders without a purchase date land in the default partition
+    merged = merged_items(seed=5)
+    pq.write_table(pa.Table.from_pandas(merged, preserve_index=False), tmp_path / "merged.parquet")
+    write_month_partitions(str(tmp_path / "merged.parquet"), str(tmp_path / "by_month"))
+    assert len(list((tmp_path / "by_month").iterdir())) > 10
+
+    dictionary = [col for col in dictionary_columns if col in merged_columns]
+    streamed = stream_partials(str(tmp_path / "by_month"), merged_columns, dictionary, batch_size=64, backend=backend)
+    fold = fold_arrow if backend == "arrow" else fold_frame
+    assert_tables_equal(streamed.tables(), fold(enrich(merged)).close_orders().tables())
+
+
+def test_streaming_reuses_the_partials_of_unchanged_partitions(tmp_path, monkeypatch):
+    merged = merged_items(seed=6)
+    pq.write_table(pa.Table.from_pandas(merged, preserve_index=False), tmp_path / "merged.parquet")
+    write_month_partitions(str(tmp_path / "merged.parquet"), str(tmp_path / "by_month"))
+    dictionary = [col for col in dictionary_columns if col in merged_columns]
+    folded = []
+    fold_batch = aggregates.fold_batch
+    monkeypatch.setattr(aggregates, "fold_batch", lambda batch, *args: folded.append(batch) or fold_batch(batch, *args))
+
+    def stream():
+        folded.clear()
+        return stream_partials(str(tmp_path / "by_month"), merged_columns, dictionary,
+                               cache_dir=str(tmp_path / "fragments"), key="k").tables()
+
+    whole = fold_frame(enrich(merged)).close_orders().tables()
+    assert_tables_equal(stream(), whole)
+    partitions = sorted((tmp_path / "by_month").iterdir())
+    assert len(folded) == len(partitions) == len(list((tmp_path / "fragments").iterdir()))
+    assert_tables_equal(stream(), whole)
+    assert not folded
+
+    # A rewritten partition is folded again, and a removed one is dropped
+    rewritten = next(partitions[0].iterdir())
+    pq.write_table(pq.ParquetFile(rewritten).read(), rewritten)
+    os.utime(rewritten, ns=(0, 0))
+    removed = partitions[1]
+    for path in removed.iterdir():
+        os.remove(path)
+    os.rmdir(removed)
+    kept = merged["order_purchase_timestamp"].dt.strftime("%Y-%m") != removed.name.split("=")[1]
+    assert_tables_equal(stream(), fold_frame(enrich(merged[kept].copy())).close_orders().tables())
+    assert len(folded) == 1
+    assert len(list((tmp_path / "fragments").iterdir())) == len(partitions) - 1
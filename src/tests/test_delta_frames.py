@@ -0,0 +1,71 @@
+import json
+import pandas as pd
+import plotly.express as px
+import plotly.io as pio
+from figures import delta_frames, flat_properties, nested_properties
+
+
+def serialized(properties):
+    return {path: json.loads(pio.json.to_json_plotly(value)) for path, value in flat_properties(properties).items()}
+
+
+def replay(fig):
+    # plotly.js's frame merge: each frame is applied over its baseframe chain,
+    # trace by trace, on top of the figure's own traces
+    frames = {frame.name: frame for frame in fig.frames}
+    merged = []
+    for frame in fig.frames:
+        chain = [frame]
+        while chain[-1].baseframe:
+            chain.append(frames[chain[-1].baseframe])
+        traces = {index: serialized(trace.to_plotly_json()) for index, trace in enumerate(fig.data)}
+        for link in reversed(chain):
+            for index, trace in zip(link.traces, link.data):
+                traces.setdefault(index, {}).update(serialized(trace.to_plotly_json()))
+        merged.append(traces)
+    return merged
+
+
+def animated_bars(frame):
+    return px.bar(frame, x="state", y="sales", color="state", animation_frame="month", animation_group="state")
+
+
+def assert_replays(fig):
+    original = [
+        {index: serialized(trace.to_plotly_json())
+         for index, trace in zip(frame.traces if frame.traces is not None else range(len(frame.data)), frame.data)}
+        for frame in fig.frames
+    ]
+    merged = replay(delta_frames(fig))
+    for frame, traces in zip(original, merged):
+        for index, properties in frame.items():
+            assert {path: traces[index][path] for path in properties} == properties
+
+
+def test_nested_properties_inverts_flat_properties():
+    properties = {"x": [1, 2], "marker": {"color": "red", "line": {"width": 2}}, "y": {"bdata": "AAE=", "dtype": "i1"}}
+    assert nested_properties(flat_properties(properties)) == properties
+
+
+def test_replay_rebuilds_every_frame():
+    frame = pd.DataFrame({
+        "state": ["SP", "RJ", "MG"] * 3,
+        "month": ["2017-01"] * 3 + ["2017-02"] * 3 + ["2017-03"] * 3,
+        "sales": [10.0, 4.0, 2.0, 12.0, 4.0, 3.0, 9.0, 5.0, 3.0],
+    })
+    assert_replays(animated_bars(frame))
+
+
+def test_later_frames_with_more_traces_than_the_first():
+    # The first month covers one state; later months add states beyond fig.data
+    frame = pd.DataFrame({
+        "state": ["SP", "SP", "RJ", "MG", "SP", "MG"],
+        "month": ["2016-09", "2016-10", "2016-10", "2016-10", "2016-11", "2016-11"],
+        "sales": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+    })
+    fig = animated_bars(frame)
+    assert len(fig.data) < max(len(frame.data) for frame in fig.frames)
+    assert_replays(fig)
+
+    added = delta_frames(animated_bars(frame)).frames[1]
+    assert [trace.type for trace in added.data] == ["bar"] * len(added.data)
@@ -0,0 +1,31 @@
+import argparse
+import pytest
+import figures
+from aggregates import Partials
+from catalog import figure_inputs
+from test_aggregates import items
+
+options = argparse.Namespace(raw_histograms=False, shared_assets=False)
+
+
+@pytest.fixture(scope="module")
+def tables():
+    # The fixture has orders without a known customer state
+    frame = items()
+    assert frame["customer_state"].isna().any()
+    return Partials.fold(frame).close_orders().tables()
+
+
+@pytest.mark.parametrize("name", list(figure_inputs))
+def test_every_figure_builds_with_missing_states(tables, name):
+    fig = getattr(figures, name)(tables, None, options)
+    assert fig.data
+
+
+def test_fig14_leaves_out_customers_without_a_state(tables):
+    fig = figures.fig14(tables, None, options)
+    known = tables["customers"]["state"].notna().sum()
+    last_month = fig.frames[-1]
+    # States without customers are padded with 1 on the log axis
+    total = sum(sum(trace.x) for trace in last_month.data)
+    assert known <= total <= known + len(tables["state_order"])
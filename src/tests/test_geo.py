@@ -0,0 +1,61 @@
+import numpy as np
+from geo import _douglas_peucker, simplify_geojson
+
+
+def border():
+    # A wiggly shared border from (1, 0) to (1, 1) with one bump well above the
+    # tolerance used below
+    y = np.linspace(0, 1, 61)
+    x = 1 + 0.001 * np.sin(y * 40) + 0.05 * np.exp(-((y - 0.5) / 0.05) ** 2)
+    x[[0, -1]] = 1
+    return [[float(a), float(b)] for a, b in zip(x, y)]
+
+
+def feature(name, ring):
+    return {"type": "Feature", "properties": {"name": name}, "geometry": {"type": "Polygon", "coordinates": [ring]}}
+
+
+def neighbours():
+    shared = border()
+    west = [[0.0, 0.0]] + shared + [[0.0, 1.0], [0.0, 0.0]]
+    east = [[2.0, 0.0], [2.0, 1.0]] + shared[::-1] + [[2.0, 0.0]]
+    return {"type": "FeatureCollection", "features": [feature("west", west), feature("east", east)]}
+
+
+def test_douglas_peucker_keeps_the_ends_and_points_beyond_the_tolerance():
+    points = np.array([[0, 0], [1, 0.001], [2, -0.001], [3, 0.5], [4, 0.001], [5, 0]], dtype=float)
+    keep = _douglas_peucker(points, 0.01)
+    assert keep[[0, 3, 5]].all()
+    line = np.array([[0, 0], [1, 0.001], [2, -0.001], [4, 0.001], [5, 0]], dtype=float)
+    assert _douglas_peucker(line, 0.01).tolist() == [True, False, False, False, True]
+    assert _douglas_peucker(points, 1.0).tolist() == [True, False, False, False, False, True]
+    assert _douglas_peucker(points, 0.0).all()
+
+
+def test_shared_borders_stay_shared():
+    geojson = neighbours()
+    shared = {tuple(point) for point in border()}
+    simplified = simplify_geojson(geojson, 0.005)
+
+    west, east = (feature["geometry"]["coordinates"][0] for feature in simplified["features"])
+    west_border = [tuple(point) for point in west if tuple(point) in shared]
+    east_border = [tuple(point) for point in east if tuple(point) in shared]
+    assert west_border == east_border[::-1]
+    assert len(west_border) < len(shared)
+    # The bump is kept
+    assert max(x for x, _ in west_border) > 1.04
+    for ring in (west, east):
+        assert ring[0] == ring[-1]
+        assert {tuple(point) for point in ring} <= {tuple(point) for feature in geojson["features"]
+                                                    for point in feature["geometry"]["coordinates"][0]}
+
+
+def test_multipolygons_and_properties_are_kept():
+    geojson = neighbours()
+    west = geojson["features"][0]
+    west["geometry"] = {"type": "MultiPolygon", "coordinates": [west["geometry"]["coordinates"],
+                                                                [[[5.0, 5.0], [6.0, 5.0], [6.0, 6.0], [5.0, 5.0]]]]}
+    simplified = simplify_geojson(geojson, 0.005)
+    assert [feature["properties"]["name"] for feature in simplified["features"]] == ["west", "east"]
+    assert simplified["features"][0]["geometry"]["type"] == "MultiPolygon"
+    assert simplified["features"][0]["geometry"]["coordinates"][1] == [[[5.0, 5.0], [6.0, 5.0], [6.0, 6.0], [5.0, 5.0]]]
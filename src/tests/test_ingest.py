@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from ingest import category_columns, id_columns, ingest, merged_columns
+
+date_columns = ["order_purchase_timestamp", "order_approved_at", "order_delivered_carrier_date",
+                "order_delivered_customer_date", "order_estimated_delivery_date"]
+
+
+@pytest.fixture
+def csv_dir(tmp_path):
+    # The three Olist CSVs, with items in a different order than their orders,
+    # items of unknown orders, orders of unknown customers, timelines running
+    # backwards and delivered orders with missing dates
+    rng = np.random.default_rng(0)
+    n_orders = 60
+    ids = lambda n: [f"{i:032x}" for i in rng.integers(0, 2 ** 63, n)]
+    customers = pd.DataFrame({
+        "customer_id": ids(40),
+        "customer_unique_id": ids(40),
+        "customer_zip_code_prefix": rng.integers(1_000, 99_999, 40),
+        "customer_city": rng.choice(["sao paulo", "rio de janeiro", "curitiba"], 40),
+        "customer_state": rng.choice(["SP", "RJ", "PR"], 40),
+    })
+    purchase = pd.Timestamp("2017-03-01") + pd.to_timedelta(rng.integers(0, 200 * 86_400, n_orders), unit="s")
+    approved = purchase + pd.to_timedelta(rng.integers(600, 2 * 86_400, n_orders), unit="s")
+    carrier = approved + pd.to_timedelta(rng.integers(3_600, 8 * 86_400, n_orders), unit="s")
+    delivered = carrier + pd.to_timedelta(rng.integers(3_600, 20 * 86_400, n_orders), unit="s")
+    orders = pd.DataFrame({
+        "order_id": ids(n_orders),
+        "customer_id": np.r_[customers["customer_id"].to_numpy()[rng.integers(0, 40, n_orders - 2)], ids(2)],
+        "order_status": rng.choice(["delivered", "shipped", "canceled"], n_orders, p=[0.8, 0.1, 0.1]),
+        "order_purchase_timestamp": purchase,
+        "order_approved_at": approved,
+        "order_delivered_carrier_date": carrier,
+        "order_delivered_customer_date": delivered,
+        "order_estimated_delivery_date": (purchase + pd.Timedelta(days=20)).normalize(),
+    })
+    orders.loc[[1, 2, 3, 10, 13, 16], "order_status"] = "delivered"
+    orders.loc[[11, 12, 14, 15, 17, 18], "order_status"] = "shipped"
+    orders.loc[orders["order_status"] != "delivered", "order_delivered_customer_date"] = pd.NaT
+    orders.loc[orders["order_status"] == "canceled", "order_delivered_carrier_date"] = pd.NaT
+    # Backwards timelines
+    orders.loc[[1, 2], "order_approved_at"] = orders.loc[[1, 2], "order_delivered_carrier_date"] + pd.Timedelta(days=1)
+    orders.loc[[3], "order_delivered_carrier_date"] = orders.loc[[3], "order_delivered_customer_date"] + pd.Timedelta(hours=5)
+    # Missing dates, to be imputed on delivered orders only
+    for i, col in enumerate(["order_approved_at", "order_delivered_carrier_date", "order_delivered_customer_date"]):
+        orders.loc[[10 + 3 * i, 11 + 3 * i, 12 + 3 * i], col] = pd.NaT
+
+    counts = rng.choice([1, 1, 2, 3], n_orders)
+    items = pd.DataFrame({
+        "order_id": np.r_[np.repeat(orders["order_id"].to_numpy(), counts), ids(2)],
+        "order_item_id": np.r_[np.concatenate([np.arange(1, count + 1) for count in counts]), 1, 1],
+    })
+    items = items.iloc[rng.permutation(len(items))].reset_index(drop=True)
+    items["product_id"] = rng.choice(ids(20), len(items))
+    items["seller_id"] = rng.choice(ids(5), len(items))
+    items["shipping_limit_date"] = pd.Timestamp("2017-03-05") + pd.to_timedelta(
+        rng.integers(0, 200 * 86_400, len(items)), unit="s")
+    items["price"] = np.round(rng.lognormal(4, 1, len(items)), 2)
+    items["freight_value"] = np.round(rng.lognormal(2.5, 0.5, len(items)), 2)
+
+    customers.to_csv(tmp_path / "olist_customers_dataset.csv", index=False)
+    items.to_csv(tmp_path / "olist_order_items_dataset.csv", index=False)
+    orders.to_csv(tmp_path / "olist_orders_dataset.csv", index=False)
+    return tmp_path
+
+
+def notebook(directory):
+    # The cleaning cells of data_analysis.ipynb
+    customers_df = pd.read_csv(directory / "olist_customers_dataset.csv")
+    orders_df = pd.read_csv(directory / "olist_order_items_dataset.csv", parse_dates=["shipping_limit_date"])
+    orderinfo_df = pd.read_csv(directory / "olist_orders_dataset.csv", parse_dates=date_columns)
+    df = orderinfo_df.merge(customers_df, on="customer_id", how="left").merge(orders_df, on="order_id", how="right")
+    for col in ["order_status", "customer_city", "customer_state", "order_item_id"]:
+        df[col] = df[col].astype("category")
+
+    df.drop(df.query("order_approved_at > order_delivered_carrier_date").index, axis=0, inplace=True)
+    df.drop(df.query("order_delivered_carrier_date > order_delivered_customer_date").index, axis=0, inplace=True)
+    df.reset_index(drop=True, inplace=True)
+
+    delivered = df["order_status"] == "delivered"
+    for col, reference in [("order_approved_at", "order_purchase_timestamp"),
+                           ("order_delivered_carrier_date", "shipping_limit_date"),
+                           ("order_delivered_customer_date", "order_estimated_delivery_date")]:
+        known = df.loc[delivered & df[col].notna()]
+        median = (known[col] - known[reference]).describe()["50%"]
+        missing = df.loc[delivered & df[col].isna()].index
+        df.loc[missing, col] = df.loc[missing, reference] + median
+    for col in ["order_id", "customer_id", "customer_unique_id", "product_id", "seller_id"]:
+        df[col] = df[col].astype("category")
+    return df
+
+
+def test_ingest_matches_the_notebook(csv_dir):
+    destination = csv_dir / "merged.parquet"
+    merged = ingest(csv_dir, destination)
+    expected = notebook(csv_dir)
+
+    items = pd.read_csv(csv_dir / "olist_order_items_dataset.csv")
+    orders = pd.read_csv(csv_dir / "olist_orders_dataset.csv", parse_dates=date_columns)
+    backwards = ((orders["order_approved_at"] > orders["order_delivered_carrier_date"])
+                 | (orders["order_delivered_carrier_date"] > orders["order_delivered_customer_date"]))
+    assert backwards.sum() == 3
+    assert len(expected) == len(items) - items["order_id"].isin(orders["order_id"][backwards]).sum()
+    imputed = orders["order_status"].eq("delivered") & orders[date_columns[1:4]].isna().any(axis=1)
+    assert imputed.sum() == 3
+
+    read_back = pq.read_table(destination)
+    assert read_back.schema.names == merged_columns
+    for col in category_columns + id_columns:
+        assert pa.types.is_dictionary(read_back.schema.field(col).type), col
+    assert read_back.schema.field("order_item_id").type == pa.int64()
+
+    actual = read_back.to_pandas()
+    for col in category_columns + id_columns + ["order_item_id"]:
+        actual[col] = actual[col].astype(object)
+        expected[col] = expected[col].astype(object)
+    # In the items' order, with the same rows dropped and the same dates imputed
+    pd.testing.assert_frame_equal(actual, expected[merged_columns], check_dtype=False)
+    assert read_back.equals(merged)
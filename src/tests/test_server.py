@@ -0,0 +1,94 @@
+import http.client
+import json
+import threading
+import pandas as pd
+import pytest
+import server
+from catalog import figure_inputs
+from test_aggregates import items
+
+
+@pytest.fixture(scope="module")
+def dashboard():
+    return server.Dashboard(items(), None)
+
+
+@pytest.fixture
+def serve():
+    # A server on a free port answering with the given dashboard
+    running = []
+
+    def start(dashboard):
+        server.Handler.dashboard = dashboard
+        httpd = server.http.server.HTTPServer(("127.0.0.1", 0), server.Handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        running.append(httpd)
+        return httpd.server_address[1]
+
+    yield start
+    for httpd in running:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def get(port, path):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    connection.request("GET", path)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_normalize_filter():
+    query = {"start": ["2017-02"], "end": [""], "states": ["rj, sp", "SP"], "delivered": ["on"]}
+    assert server.normalize_filter(query) == (565, None, ("RJ", "SP"), True)
+    with pytest.raises(ValueError):
+        server.normalize_filter({"states": ["XX"]})
+    with pytest.raises(ValueError):
+        server.normalize_filter({"start": ["2017-13"]})
+
+
+@pytest.mark.parametrize("name", list(figure_inputs))
+def test_slices_without_deliveries_draw_every_figure(dashboard, name):
+    # The invoiced orders were never shipped, so no delivery duration has a value
+    never_shipped = dashboard.frame[dashboard.frame["order_status"] == "invoiced"]
+    assert never_shipped["order_delivered_carrier_date"].isna().all()
+    state, month = never_shipped[["customer_state", "month_ordinal"]].dropna().iloc[0]
+    assert server.Dashboard(never_shipped, None).figure_json(name, (int(month), int(month), (state,), False))
+
+
+@pytest.mark.parametrize("key", [
+    (None, None, (), False),
+    (None, None, ("AC", "AL"), False),
+    (565, None, (), False),
+    (None, 570, ("AC",), False),
+    (566, 572, ("AC", "AM", "AP"), False),
+    (800, None, (), False),
+])
+def test_cube_slices_match_refolded_rows(dashboard, key):
+    refolded = dashboard.tables(key)
+    sliced = dashboard.cube_tables_for(key)
+    if refolded is None:
+        assert sliced is None
+        return
+    for name in server.cube_tables:
+        if name == "state_order":
+            assert sliced[name] == refolded[name]
+        elif name == "state_month_sales":
+            pd.testing.assert_series_equal(sliced[name], refolded[name])
+        else:
+            pd.testing.assert_frame_equal(sliced[name], refolded[name])
+    assert server.cube_figures == {"fig7", "fig11", "fig12", "fig13"}
+
+
+def test_failures_are_answered_as_json(dashboard, serve, monkeypatch):
+    port = serve(dashboard)
+    assert get(port, "/figures/fig9")[0] == 200
+    assert get(port, "/figures/fig9?states=XX")[0] == 400
+    assert get(port, "/figures/nope")[0] == 404
+
+    def broken(tables, geojson, args):
+        raise KeyError("metric")
+
+    monkeypatch.setattr(server.figures, "fig9", broken)
+    status, body = get(port, "/figures/fig9?states=AC")
+    assert status == 500 and "fig9" in body["error"]
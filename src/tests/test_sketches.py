@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sketches import HyperLogLog
+
+
+def ids(start, stop):
+    return pd.Series([f"{i:032x}" for i in range(start, stop)])
+
+
+@pytest.mark.parametrize("distinct", [50, 5_000, 200_000])
+@pytest.mark.parametrize("precision", [10, 14])
+def test_count_within_error_bound(precision, distinct):
+    # Four standard errors; the hashes are deterministic, so this never flakes
+    sketch = HyperLogLog(precision).update(ids(0, distinct))
+    assert abs(sketch.count() - distinct) <= 4 * 1.04 / np.sqrt(2 ** precision) * distinct
+
+
+def test_duplicates_and_missing_values_are_not_counted():
+    values = pd.concat([ids(0, 1000)] * 3 + [pd.Series([None, np.nan])], ignore_index=True)
+    assert HyperLogLog(12).update(values).count() == HyperLogLog(12).update(ids(0, 1000)).count()
+
+
+def test_merge_is_commutative_and_equals_the_sketch_of_the_union():
+    a = HyperLogLog(12).update(ids(0, 30_000))
+    b = HyperLogLog(12).update(ids(20_000, 60_000))
+    whole = HyperLogLog(12).update(ids(0, 60_000))
+    np.testing.assert_array_equal(a.merge(b).registers, b.merge(a).registers)
+    np.testing.assert_array_equal(a.merge(b).registers, whole.registers)
+    np.testing.assert_array_equal(HyperLogLog.union([b, a]).registers, whole.registers)
+
+
+def test_merge_rejects_other_precisions():
+    with pytest.raises(ValueError):
+        HyperLogLog(10).merge(HyperLogLog(12))
+
+
+def test_grouped_matches_a_sketch_per_key():
+    keys = pd.Series(["SP", "RJ", None, "SP", "MG"] * 400)
+    values = ids(0, 2000)
+    sketches = HyperLogLog.grouped(keys, values, 11)
+    assert sorted(sketches) == ["MG", "RJ", "SP"]
+    for key, sketch in sketches.items():
+        expected = HyperLogLog(11).update(values[(keys == key).to_numpy()])
+        np.testing.assert_array_equal(sketch.registers, expected.registers)
+
+
+def test_precision_for():
+    assert HyperLogLog.precision_for(0.02) == 12
+    assert HyperLogLog.precision_for(0.5) == 4
+    assert HyperLogLog.precision_for(1e-6) == 18
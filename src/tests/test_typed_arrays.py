@@ -0,0 +1,43 @@
+import base64
+import numpy as np
+import plotly.graph_objects as go
+from figures import trim_precision, typed_array
+
+plotly_dtypes = {"i1": "int8", "i2": "int16", "i4": "int32", "f4": "float32", "f8": "float64"}
+
+
+def decoded(spec):
+    values = np.frombuffer(base64.b64decode(spec["bdata"]), dtype=plotly_dtypes[spec["dtype"]])
+    if "shape" in spec:
+        values = values.reshape([int(size) for size in spec["shape"].split(",")])
+    return values
+
+
+def test_typed_arrays_pick_the_smallest_exact_dtype():
+    cases = [
+        (np.array([1.0, -3.0, 100.0]), "i1"),
+        (np.array([1.0, 300.0]), "i2"),
+        (np.array([1.0, -70_000.0]), "i4"),
+        (np.array([0.5, 1.25, np.nan]), "f4"),
+        (np.array([0.1, 2.0 ** 40]), "f8"),
+    ]
+    for values, dtype in cases:
+        spec = typed_array(values, 3)
+        assert spec["dtype"] == dtype
+        np.testing.assert_array_equal(decoded(spec), np.round(values, 3))
+
+
+def test_typed_arrays_keep_the_shape_of_matrices():
+    values = np.arange(7 * 24, dtype="float64").reshape(7, 24) / 4
+    spec = typed_array(values, 2)
+    assert spec["shape"] == "7, 24"
+    np.testing.assert_array_equal(decoded(spec), values)
+
+
+def test_trim_precision_leaves_ranges_and_strings_alone():
+    fig = go.Figure(go.Scatter(x=[0.123456, 1.5], y=[2.0, 3.0], text=["a", "b"]))
+    fig.update_layout(xaxis_range=[0.111111, 2.222222])
+    trace = trim_precision(fig, 2).data[0]
+    np.testing.assert_array_equal(decoded(trace.to_plotly_json()["x"]), [0.12, 1.5])
+    assert list(fig.layout.xaxis.range) == [0.111111, 2.222222]
+    assert list(trace.text) == ["a", "b"]